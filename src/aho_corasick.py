@@ -0,0 +1,89 @@
+#aho_corasick.py
+#Copyright (c) 2020 Rachel Lea Ballantyne Draelos
+
+#MIT License
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE
+
+"""Multi-pattern substring search. All the patterns are compiled into a single
+Aho-Corasick automaton so that finding every pattern that occurs in a piece of
+text takes one pass over the text, instead of one 'pattern in text' scan per
+pattern."""
+
+class Automaton(object):
+    def __init__(self, patterns):
+        """Build the automaton.
+        
+        Variables:
+        <patterns> is a list of strings. The result of find() refers to
+            patterns by their position in this list."""
+        self.patterns = list(patterns)
+        
+        #Trie of the patterns. goto[state] maps a character to the next state,
+        #and output[state] lists the patterns that end at that state.
+        goto = [{}]
+        output = [[]]
+        for pattern_idx, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                if char not in goto[state]:
+                    goto.append({})
+                    output.append([])
+                    goto[state][char] = len(goto)-1
+                state = goto[state][char]
+            output[state].append(pattern_idx)
+        
+        #Breadth-first pass to add the failure links. Every state inherits the
+        #outputs of its failure state, and the missing transitions are filled
+        #in from the failure state so that find() never has to backtrack.
+        #Characters that do not occur in any pattern are not stored and
+        #simply lead back to the root.
+        fail = [0]*len(goto)
+        queue = list(goto[0].values())
+        for state in queue:
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+        for state in queue:
+            for char, next_state in list(goto[state].items()):
+                if state != 0:
+                    fail[next_state] = goto[fail[state]].get(char, 0)
+                    output[next_state] = output[next_state]+output[fail[next_state]]
+            if state != 0:
+                for char, next_state in goto[fail[state]].items():
+                    if char not in goto[state]:
+                        goto[state][char] = next_state
+        self.goto = goto
+        self.output = [tuple(x) for x in output]
+        
+        #Empty patterns occur in every text
+        self.always = frozenset(self.output[0])
+    
+    def find(self, text):
+        """Return the set of indices of the patterns that occur anywhere in
+        <text> (the same answer as checking 'pattern in text' for every
+        pattern)"""
+        goto = self.goto
+        output = self.output
+        hits = set(self.always)
+        state = 0
+        for char in text:
+            state = goto[state].get(char, 0)
+            if output[state]:
+                hits.update(output[state])
+        return hits
@@ -0,0 +1,51 @@
+#cache_files.py
+#Copyright (c) 2020 Rachel Lea Ballantyne Draelos
+
+#MIT License
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE
+
+import os
+import pickle
+import shutil
+
+"""Writing the files of the caches that are shared across runs and processes
+(compiled vocabularies, rule results, classifier predictions, and the model
+registry). Each file is written to a temporary file first and then renamed,
+so a process that is loading the file never sees a partially written file."""
+
+def save_pickle_atomically(obj, path):
+    """Pickle <obj> to the file <path>, creating its directory if needed"""
+    temp_path = _temporary_path(path)
+    with open(temp_path, 'wb') as f:
+        pickle.dump(obj, f)
+    os.replace(temp_path, path)
+
+def copy_file_atomically(source_path, path):
+    """Copy the file <source_path> to <path>, creating its directory if
+    needed"""
+    temp_path = _temporary_path(path)
+    shutil.copyfile(source_path, temp_path)
+    os.replace(temp_path, path)
+
+def _temporary_path(path):
+    directory = os.path.dirname(path)
+    if (directory != '') and (not os.path.isdir(directory)):
+        os.makedirs(directory, exist_ok=True)
+    return path+'.'+str(os.getpid())
@@ -0,0 +1,89 @@
+#hashing_classifier.py
+#Copyright (c) 2020 Rachel Lea Ballantyne Draelos
+
+#MIT License
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import LogisticRegression
+
+"""In-process alternative to the Fasttext sentence classifier: the sentences are
+turned into sparse feature vectors with hashing vectorizers over word n-grams
+and character n-grams, and a logistic regression classifies them as 'sick' or
+'healthy'. Everything is done in memory (no text files are written) and the
+hashing vectorizers have no vocabulary to fit, so the model is only the
+weights of the logistic regression.
+
+predict() and test() have the same outputs as the methods of a Fasttext
+model, so that ClassifySentences can use either one."""
+
+class HashingClassifier(object):
+    def __init__(self, n_features=2**20, word_ngram_range=(1,2),
+                 char_ngram_range=(2,5), C=10.0, max_iter=1000):
+        """Variables:
+        <n_features>: int, number of hashed features for each of the word
+            n-grams and the character n-grams
+        <word_ngram_range>: tuple of the smallest and largest word n-grams
+        <char_ngram_range>: tuple of the smallest and largest character
+            n-grams. Character n-grams are only taken from inside words.
+        <C>: inverse regularization strength of the logistic regression
+        <max_iter>: maximum number of iterations of the logistic regression"""
+        self.word_vectorizer = HashingVectorizer(analyzer='word', token_pattern=r'\S+',
+                ngram_range=word_ngram_range, n_features=n_features, alternate_sign=False)
+        self.char_vectorizer = HashingVectorizer(analyzer='char_wb',
+                ngram_range=char_ngram_range, n_features=n_features, alternate_sign=False)
+        self.model = LogisticRegression(C=C, max_iter=max_iter, solver='liblinear')
+    
+    def vectorize(self, sentences):
+        """Return a sparse matrix with one row of features for each sentence
+        in the list <sentences>"""
+        return sparse.hstack([self.word_vectorizer.transform(sentences),
+                              self.char_vectorizer.transform(sentences)]).tocsr()
+    
+    def train(self, sentences, labels):
+        """Train on the list of strings <sentences> and the list of
+        corresponding <labels>, which are 's' (sick) or 'h' (healthy)"""
+        self.model.fit(self.vectorize(sentences), (np.array(labels)=='s').astype('int'))
+        return self
+    
+    def predict_sick_probs(self, sentences):
+        """Return an array of the probability that each sentence in the list
+        <sentences> is sick"""
+        return self.model.predict_proba(self.vectorize(sentences))[:,list(self.model.classes_).index(1)]
+    
+    def predict(self, sentences):
+        """Return a tuple of (labels, probabilities) in the same format as the
+        predict() method of a Fasttext model: for each sentence, a list with
+        the most likely label ('__label__s' or '__label__h') and an array
+        with the probability of that label"""
+        sick_probs = self.predict_sick_probs(sentences)
+        labels = [['__label__s'] if x >= 0.5 else ['__label__h'] for x in sick_probs.tolist()]
+        probs = [np.array([x if x >= 0.5 else 1 - x]) for x in sick_probs.tolist()]
+        return labels, probs
+    
+    def test(self, sentences, labels):
+        """Return a tuple of (N, precision at 1, recall at 1) on <sentences>
+        with true <labels> like the test() method of a Fasttext model. With
+        one label per sentence both are the accuracy."""
+        predicted = np.where(self.predict_sick_probs(sentences) >= 0.5, 's', 'h')
+        accuracy = float((predicted == np.array(labels)).mean())
+        return len(sentences), accuracy, accuracy
@@ -0,0 +1,304 @@
+#label_store.py
+#Copyright (c) 2020 Rachel Lea Ballantyne Draelos
+
+#MIT License
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE
+
+import os
+import json
+import pickle
+import shutil
+import numpy as np
+import pandas as pd
+
+"""Storage for the abnormality x location labels produced by the term search"""
+
+class BinaryLabels(object):
+    """Binary abnormality x location labels for a set of reports.
+    
+    All the labels are held in a single uint8 array <self.array> of shape
+    (reports, diseases, locations). For backward compatibility with the old
+    output format (a dictionary where the keys are filenames and the values
+    are pandas dataframes with diseases as rows and locations as columns)
+    BinaryLabels can be used like that dictionary: out_bin[filename]
+    returns the dataframe for one report, out_bin.keys() returns the
+    filenames, out_bin.values() and out_bin.items() return the dataframes,
+    and out_bin.update() sets the labels of some reports."""
+    def __init__(self, filenames, diseases, locations, array=None):
+        """Variables:
+        <filenames>: list of report IDs, one per row of <array>
+        <diseases>: list of disease names, e.g. including 'other_disease'
+        <locations>: list of location names, e.g. including 'other_location'
+        <array>: optional array of shape (len(filenames), len(diseases),
+            len(locations)). If not provided, all labels start at zero."""
+        self.filenames = list(filenames)
+        self.diseases = list(diseases)
+        self.locations = list(locations)
+        shape = (len(self.filenames), len(self.diseases), len(self.locations))
+        if array is None:
+            array = np.zeros(shape, dtype='uint8')
+        assert array.shape == shape
+        self.array = array.astype('uint8', copy=False)
+        self._build_indices()
+        self.clear_cache()
+    
+    def _build_indices(self):
+        self.filename_index = {f:idx for idx, f in enumerate(self.filenames)}
+        self.disease_index = {d:idx for idx, d in enumerate(self.diseases)}
+        self.location_index = {l:idx for idx, l in enumerate(self.locations)}
+        assert len(self.filename_index) == len(self.filenames), 'Duplicate filenames'
+    
+    # Dictionary-like access #--------------------------------------------------
+    def __getitem__(self, filename):
+        """Return the disease x location dataframe for report <filename>"""
+        return pd.DataFrame(self.array[self.filename_index[filename]],
+                            index = self.diseases, columns = self.locations)
+    
+    def __contains__(self, filename):
+        return filename in self.filename_index
+    
+    def __iter__(self):
+        return iter(self.filenames)
+    
+    def __len__(self):
+        return len(self.filenames)
+    
+    def keys(self):
+        return list(self.filenames)
+    
+    def values(self):
+        for filename in self.filenames:
+            yield self[filename]
+    
+    def items(self):
+        for filename in self.filenames:
+            yield filename, self[filename]
+    
+    def update(self, other):
+        """Set the labels of every report in <other> to the labels in <other>,
+        adding the reports that are not in self yet, like dict.update().
+        <other> is a BinaryLabels object or a dictionary where the keys are
+        filenames and the values are disease x location dataframes."""
+        if isinstance(other, BinaryLabels):
+            assert other.diseases == self.diseases
+            assert other.locations == self.locations
+            filenames, array = other.filenames, other.array
+        else:
+            filenames = list(other.keys())
+            array = np.zeros((len(filenames), len(self.diseases), len(self.locations)), dtype='uint8')
+            for idx, filename in enumerate(filenames):
+                array[idx] = other[filename].loc[self.diseases, self.locations].values
+        new_filenames = [f for f in filenames if f not in self.filename_index]
+        if len(new_filenames) > 0:
+            added = np.zeros((len(new_filenames), len(self.diseases), len(self.locations)), dtype='uint8')
+            self.array = np.concatenate([self.array, added], axis=0)
+            self.filenames = self.filenames+new_filenames
+            self._build_indices()
+        elif not self.array.flags.writeable:
+            self.array = self.array.copy()
+        self.array[[self.filename_index[f] for f in filenames]] = array
+        self.clear_cache()
+    
+    def to_dict(self):
+        """Return the labels in the old output format, a dictionary of
+        dataframes"""
+        return dict(self.items())
+    
+    @staticmethod
+    def from_dict(labels_dict, diseases=None, locations=None):
+        """Return a BinaryLabels made from <labels_dict>, a dictionary in the
+        old output format (e.g. a loaded _BinaryLabels.pkl file). If
+        <diseases> and <locations> are not provided they are taken from the
+        index and columns of the first dataframe."""
+        if (diseases is None) or (locations is None):
+            first = labels_dict[list(labels_dict.keys())[0]]
+            diseases = first.index.values.tolist() if diseases is None else diseases
+            locations = first.columns.values.tolist() if locations is None else locations
+        out_bin = BinaryLabels([], diseases, locations)
+        out_bin.update(labels_dict)
+        return out_bin
+    
+    # Binarized labels #--------------------------------------------------------
+    def presence(self, label_type):
+        """Return a boolean array of shape (reports, diseases) if <label_type>
+        is 'disease' or (reports, locations) if <label_type> is 'location',
+        which is True where the report has that disease in any location
+        (or that location with any disease).
+        The result is cached. If self.array is modified after this is
+        called, call clear_cache()."""
+        assert label_type in ['disease','location']
+        if label_type not in self._presence:
+            axis = 2 if label_type == 'disease' else 1
+            self._presence[label_type] = self.array.any(axis=axis)
+        return self._presence[label_type]
+    
+    def clear_cache(self):
+        self._presence = {}
+    
+    def binarize(self, chosen_labels, label_type):
+        """Return a dataframe with index of filenames and columns of
+        <chosen_labels>, where a value of 1 means the report has that label.
+        This is the old-fashioned output format.
+        <label_type> is the type of the chosen_labels. It is either 'disease'
+        (to reduce over locations) or 'location' (to reduce over diseases)"""
+        index = self.disease_index if label_type == 'disease' else self.location_index
+        columns = [index[label] for label in chosen_labels]
+        return pd.DataFrame(self.presence(label_type)[:,columns].astype('float'),
+                            index = self.filenames, columns = chosen_labels)
+    
+    # Selecting and combining reports #-----------------------------------------
+    def select(self, filenames):
+        """Return a new BinaryLabels with only the reports in <filenames>,
+        in that order"""
+        rows = [self.filename_index[f] for f in filenames]
+        return BinaryLabels(filenames, self.diseases, self.locations,
+                            self.array[rows])
+    
+    @staticmethod
+    def concat(all_labels):
+        """Return a new BinaryLabels containing the reports of every
+        BinaryLabels in the list <all_labels>, which must all have the same
+        diseases and locations. If a filename is in more than one of them,
+        the labels of the last one are used, like with dict.update()."""
+        first = all_labels[0]
+        for labels in all_labels[1:]:
+            assert labels.diseases == first.diseases
+            assert labels.locations == first.locations
+        filenames = [f for labels in all_labels for f in labels.filenames]
+        if len(set(filenames)) < len(filenames):
+            out_bin = BinaryLabels(first.filenames, first.diseases, first.locations, first.array.copy())
+            for labels in all_labels[1:]:
+                out_bin.update(labels)
+            return out_bin
+        array = np.concatenate([labels.array for labels in all_labels], axis=0)
+        return BinaryLabels(filenames, first.diseases, first.locations, array)
+    
+    # Pickling #----------------------------------------------------------------
+    def __getstate__(self):
+        #the index dictionaries are rebuilt on loading
+        return {'filenames':self.filenames, 'diseases':self.diseases,
+                'locations':self.locations, 'array':self.array}
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build_indices()
+        self.clear_cache()
+    
+    # Packed storage #----------------------------------------------------------
+    def save_packed(self, path_prefix):
+        """Save the labels in the compact format that is read by PackedLabels:
+        <path_prefix>_PackedLabels.npy holds the array packed to bits along the
+        locations axis with np.packbits (about 8x smaller than the uint8
+        array) and <path_prefix>_PackedLabels.json holds the filenames in row
+        order and the names of the diseases and locations."""
+        writer = PackedLabelsWriter(path_prefix, self.diseases, self.locations)
+        writer.append(self)
+        writer.close()
+
+def load_binary_labels(path_prefix):
+    """Return the BinaryLabels saved under <path_prefix>, read from the
+    <path_prefix>_PackedLabels files, or from <path_prefix>_BinaryLabels.pkl
+    for results directories that were made before the packed format
+    existed"""
+    if os.path.isfile(path_prefix+'_PackedLabels.npy'):
+        return PackedLabels(path_prefix).to_binary_labels()
+    with open(path_prefix+'_BinaryLabels.pkl', 'rb') as f:
+        return BinaryLabels.from_dict(pickle.load(f))
+
+class PackedLabelsWriter(object):
+    """Write the files of a PackedLabels store one chunk of reports at a time,
+    so that the labels of a whole corpus never have to be in memory at once"""
+    def __init__(self, path_prefix, diseases, locations):
+        self.path_prefix = path_prefix
+        self.diseases = list(diseases)
+        self.locations = list(locations)
+        self.filenames = []
+        self.filename_index = {}
+        #the packed rows are appended to a temporary file, which becomes the
+        #.npy file once the final number of reports is known
+        self.partial_path = path_prefix+'_PackedLabels.npy.partial'
+        self.partial_file = open(self.partial_path, 'wb')
+    
+    def append(self, out_bin):
+        """Append the reports of BinaryLabels <out_bin> to the store"""
+        assert out_bin.diseases == self.diseases
+        assert out_bin.locations == self.locations
+        for filename in out_bin.filenames:
+            assert filename not in self.filename_index, 'Duplicate filename '+str(filename)
+            self.filename_index[filename] = len(self.filenames)
+            self.filenames.append(filename)
+        self.partial_file.write(np.packbits(out_bin.array, axis=2).tobytes())
+    
+    def close(self):
+        """Write the final .npy file and the .json sidecar"""
+        self.partial_file.close()
+        shape = (len(self.filenames), len(self.diseases), (len(self.locations)+7)//8)
+        header = {'descr':np.lib.format.dtype_to_descr(np.dtype('uint8')),
+                  'fortran_order':False, 'shape':shape}
+        with open(self.path_prefix+'_PackedLabels.npy', 'wb') as f:
+            np.lib.format.write_array_header_1_0(f, header)
+            with open(self.partial_path, 'rb') as partial:
+                shutil.copyfileobj(partial, f)
+        os.remove(self.partial_path)
+        #the filenames are saved as a list rather than as the filename -> row
+        #dictionary because JSON would turn numeric filenames into strings
+        sidecar = {'filenames':self.filenames, 'diseases':self.diseases,
+                   'locations':self.locations}
+        with open(self.path_prefix+'_PackedLabels.json', 'w') as f:
+            json.dump(sidecar, f)
+
+class PackedLabels(object):
+    """Read-only access to labels saved by BinaryLabels.save_packed().
+    The packed array is memory-mapped, so opening the store is nearly
+    instant and looking up one report only reads that report's rows from
+    disk."""
+    def __init__(self, path_prefix):
+        with open(path_prefix+'_PackedLabels.json', 'r') as f:
+            sidecar = json.load(f)
+        self.filenames = sidecar['filenames']
+        self.filename_index = {f:idx for idx, f in enumerate(self.filenames)}
+        self.diseases = sidecar['diseases']
+        self.locations = sidecar['locations']
+        self.packed = np.load(path_prefix+'_PackedLabels.npy', mmap_mode='r')
+        assert self.packed.shape[0] == len(self.filename_index)
+    
+    def matrix(self, filename):
+        """Return the disease x location uint8 array for report <filename>"""
+        packed_report = np.asarray(self.packed[self.filename_index[filename]])
+        return np.unpackbits(packed_report, axis=1)[:,0:len(self.locations)]
+    
+    def __getitem__(self, filename):
+        """Return the disease x location dataframe for report <filename>"""
+        return pd.DataFrame(self.matrix(filename), index = self.diseases,
+                            columns = self.locations)
+    
+    def __contains__(self, filename):
+        return filename in self.filename_index
+    
+    def __len__(self):
+        return len(self.filename_index)
+    
+    def keys(self):
+        return list(self.filenames)
+    
+    def to_binary_labels(self):
+        """Return all the labels as a BinaryLabels object"""
+        array = np.unpackbits(np.asarray(self.packed), axis=2)[:,:,0:len(self.locations)]
+        return BinaryLabels(self.keys(), self.diseases, self.locations, array)
@@ -25,11 +25,8 @@ import os
 import re
 import copy
 import string
-import numpy as np
 import pandas as pd
 
-from src.rules import rule_functions
-
 #Note that os.getcwd() yields the directory containing main.py, assuming that
 #main.py was used to call this script. Example:
 #C:\Users\Rachel\Documents\CarinLab\Project_CT\Code\hiermodel2
@@ -98,10 +95,8 @@ def load_merged_with_style(dataset_descriptor, style):
         test_merged.drop_duplicates(subset='Sentence',keep='first',inplace=True)
         print('\t\ttest shape after:',test_merged.shape)
         #Remove overlapping sentences from test set:
-        train_sentences = train_merged['Sentence'].values.tolist()
-        for index in test_merged.index.values.tolist():
-            if test_merged.at[index,'Sentence'] in train_sentences:
-                test_merged.drop(index=index, inplace=True)
+        report_overlap({'train':train_merged,'test':test_merged,'predict':predict_merged})
+        test_merged = remove_overlap(test_merged, train_merged)
         print('\t\ttest shape after removing overlap with train set:',test_merged.shape)
     return train_merged, test_merged, predict_merged
 
@@ -201,35 +196,48 @@ def load_groundtruth_duke_ct_2019_09_25():
 def expand_by_indication(merged): #Done with testing
     """For each sentence that includes the word 'indication' replace it with
     multiple sentences based on splitting up the giant indication text blocks"""
-    non_ind = merged[~merged['Sentence'].str.contains('indication')]
-    old_ind = merged[merged['Sentence'].str.contains('indication')]
+    is_ind = merged['Sentence'].str.contains('indication').values
+    non_ind = merged[~is_ind]
+    old_ind = merged[is_ind]
     assert non_ind.shape[0]+old_ind.shape[0]==merged.shape[0]
-    #make new dataframe for the indications
-    new_ind = pd.DataFrame(np.empty((old_ind.shape[0]*20,old_ind.shape[1])),
-                           columns=old_ind.columns.values.tolist(),
-                           dtype = 'object')
-    newidx = 0
-    for oldidx in old_ind.index.values.tolist():
-        label = old_ind.at[oldidx,'Label']
-        sentence = old_ind.at[oldidx,'Sentence']
-        filename = old_ind.at[oldidx,'Filename']
-        section = old_ind.at[oldidx,'Section']
-        if 'BinLabel' in old_ind.columns.values.tolist():
-            binlabel = old_ind.at[oldidx,'BinLabel']
-        for subsent in split_indication_sentence(sentence):
-            new_ind.at[newidx,'Label'] = label
-            new_ind.at[newidx,'Sentence'] = subsent
-            new_ind.at[newidx,'Filename'] = filename
-            new_ind.at[newidx,'Section'] = section
-            if 'BinLabel' in old_ind.columns.values.tolist():
-                new_ind.at[newidx,'BinLabel'] = binlabel
-            newidx+=1
-    new_ind = new_ind[new_ind['Section'].isin(['Findings','Impression'])]
+    #make new dataframe for the indications, with one row per subsentence
+    #(explode() gives NaN for indications without subsentences, which are
+    #removed along with the rows that are not in the Findings or Impression)
+    new_ind = old_ind.assign(Sentence=old_ind['Sentence'].map(split_indication_sentence)).explode('Sentence')
+    new_ind = new_ind[(new_ind['Sentence'].notnull()) & (new_ind['Section'].isin(['Findings','Impression']))]
     new_merged = pd.concat([non_ind, new_ind],axis=0,ignore_index=True)
     assert new_merged.shape[0]==non_ind.shape[0]+new_ind.shape[0]
     assert new_merged.shape[0]>merged.shape[0]
     return new_merged
 
+#Words on which the indication sentences are split, and words that are removed
+#from them. The replacements are done one word at a time (not with one regex
+#for all the words) because a replacement can change which of the later words
+#are found.
+INDICATION_SPLIT_WORDS = ['comparison','compare','protocol','technique','indication',
+                 'history of','history','facility duh','facility',' f u ',
+                 'follow up']
+INDICATION_REMOVE_WORDS = ['%date','date','%time']
+DIGITS = re.compile(r'\d')
+
+#Everything after any of these words is deleted from an indication
+#subsentence
+INDICATION_CLEANUP_WORDS = ['evaluation for','evaluate for',' eval for','assess','preop',
+                 'prior to','pre surgery','pre op','rule out',
+                 'surgical planning','workup for','plans for']
+INDICATION_CLEANUP = re.compile('|'.join([re.escape(word) for word in INDICATION_CLEANUP_WORDS]))
+
+#Indication subsentences that are removed entirely
+PLAGUES = frozenset(['rpt ct chest wo contrast w d mips',
+        'ct chest without contrast',
+        'volumetric non contrast chest ct acquisition was performed from the lower neck to the adrenal glands',
+        'ct chest','none','ct chest without contrast d','chest ct',
+        'mm axial images with mm reconstructions were obtained from the neck base through the upper abdomen without iv contrast material',
+        'ct d','ct chest without contrast with d mips',
+        'ct chest without intravenous contrast','exams chest ct d',
+        's for the examination','multiple prior ct examinations with the most recent',
+        'ct chest d','chest ct without contrast'])
+
 def split_indication_sentence(sentence):
     """Handle the huge 'sentences' that include the indication, e.g.
     'rpt ct chest wo contrast w 3d mips protocol date %date facility
@@ -244,40 +252,28 @@ def split_indication_sentence(sentence):
     adrenal glands'
     """
     x = sentence
-    for word in ['comparison','compare','protocol','technique','indication',
-                 'history of','history','facility duh','facility',' f u ',
-                 'follow up']:
+    for word in INDICATION_SPLIT_WORDS:
         x = x.replace(word,'.') #so that we will split on all these words too
-    for word in ['%date','date','%time']:
+    for word in INDICATION_REMOVE_WORDS:
         x = x.replace(word,'')
     x = x.split('.')
-    x = [re.sub('\d','',z).strip() for z in x]
-    x = [z for z in x if len(z)>1]
-    x = [' '.join(z.split()) for z in x]
+    x = [DIGITS.sub('',z).strip() for z in x]
+    x = [' '.join(z.split()) for z in x if len(z)>1]
     
-    #clean up sentences
+    #clean up sentences: the same as applying rule_functions.delete_part()
+    #with delete_part='after' for each cleanup word in order, i.e. cutting
+    #the sentence at the first occurrence of each word in what is left of it
     temp = []
     for sent in x:
-        for word in ['evaluation for','evaluate for',' eval for','assess','preop',
-                 'prior to','pre surgery','pre op','rule out',
-                 'surgical planning','workup for','plans for']:
-            _, sent = rule_functions.delete_part(sent, 'after', word)
+        if INDICATION_CLEANUP.search(sent) is not None:
+            end = len(sent)
+            for word in INDICATION_CLEANUP_WORDS:
+                idx = sent.find(word, 0, end)
+                if idx != -1:
+                    end = idx
+            sent = sent[0:end]
         temp.append(sent)
-    
-    plagues = ['rpt ct chest wo contrast w d mips',
-        'ct chest without contrast',
-        'volumetric non contrast chest ct acquisition was performed from the lower neck to the adrenal glands',
-        'ct chest','none','ct chest without contrast d','chest ct',
-        'mm axial images with mm reconstructions were obtained from the neck base through the upper abdomen without iv contrast material',
-        'ct d','ct chest without contrast with d mips',
-        'ct chest without intravenous contrast','exams chest ct d',
-        's for the examination','multiple prior ct examinations with the most recent',
-        'ct chest d','chest ct without contrast']
-    temp2 = []
-    for sent in temp:
-        if sent not in plagues:
-            temp2.append(sent)
-    return temp2
+    return [sent for sent in temp if sent not in PLAGUES]
 
 #######################
 # Load OpenI Data Set #---------------------------------------------------------
@@ -353,3 +349,39 @@ def clean_merged(merged,setname):
     #explicitly each time it occurs in the dataset (because of the FSS)
     return merged.drop(labels='Count',axis='columns')
 
+##########################
+# Overlap Between Splits #------------------------------------------------------
+##########################
+def remove_overlap(data, reference, column='Sentence'):
+    """Return <data> without the rows whose value in <column> also occurs in
+    <column> of the dataframe <reference>. This is a hash-based anti-join:
+    the values of <reference> are only hashed once and the rows of <data> are
+    selected with one boolean mask, so it takes linear time."""
+    return data[~data[column].isin(reference[column].unique())].copy()
+
+def report_overlap(splits, column='Sentence'):
+    """Print and return statistics about the values of <column> that are
+    shared between the dataframes in the dictionary <splits>, e.g.
+    {'train':train_merged,'test':test_merged,'predict':predict_merged}.
+    The output is a dictionary where the keys are tuples of two split names
+    (first, second) and the values are dictionaries with
+        'shared_unique': number of unique values that occur in both splits
+        'second_rows_in_first': number of rows of the second split whose value
+            occurs in the first split (i.e. the rows that remove_overlap()
+            would remove from the second split)
+        'second_rows': number of rows of the second split"""
+    names = [name for name in splits.keys() if not splits[name].empty]
+    uniques = {name:pd.Index(splits[name][column].unique()) for name in names}
+    stats = {}
+    for first_idx in range(len(names)):
+        for second_idx in range(first_idx+1, len(names)):
+            first = names[first_idx]
+            second = names[second_idx]
+            in_first = splits[second][column].isin(uniques[first]).values
+            stats[(first,second)] = {'shared_unique':len(uniques[first].intersection(uniques[second])),
+                                     'second_rows_in_first':int(in_first.sum()),
+                                     'second_rows':len(in_first)}
+            print('\t'+first+'/'+second+' overlap: '+str(stats[(first,second)]['shared_unique'])
+                  +' shared unique '+column+' values, '+str(stats[(first,second)]['second_rows_in_first'])
+                  +' of '+str(len(in_first))+' '+second+' rows occur in '+first)
+    return stats
@@ -0,0 +1,287 @@
+#compiled_rules.py
+#Copyright (c) 2020 Rachel Lea Ballantyne Draelos
+
+#MIT License
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE
+
+import os
+import re
+import sys
+import pickle
+import hashlib
+import inspect
+import numpy as np
+import pandas as pd
+
+from src import aho_corasick, cache_files
+from src.rules import rule_functions, token_rules
+
+"""Compiled version of a rule set (a RULES_ORDER list and a RULES_DEF
+dictionary, e.g. rules_ct.RULES_ORDER_CT and rules_ct.RULES_DEF_CT).
+
+A rule can only modify a sentence if its trigger word occurs in the sentence
+(every rule function returns the sentence unchanged otherwise), so instead of
+calling every rule on every sentence, one Aho-Corasick pass finds all the
+trigger words that occur in the sentence and only those rules are run, in
+their defined order. Because a rule can change the sentence, the trigger words
+are found again after every change, and once no trigger word is left (e.g.
+because the sentence was deleted) the remaining rules are skipped."""
+
+#Compiled rule sets that were already built or loaded in this process, keyed
+#by fingerprint and runtime, so that train, test, and predict share one cache of results
+LOADED = {}
+
+def load_compiled_rules(rules_order, rules_def, cache_dir=None, runtime='string'):
+    """Return the CompiledRules for <rules_order> and <rules_def> that uses
+    <runtime> (see CompiledRules).
+    If <cache_dir> is provided, the rule results that were saved by
+    save_cache() in <cache_dir> for this rule set are loaded, so that they
+    are reused by later runs until the rules change. The cached results are
+    kept in memory, so the memory used grows with the number of unique
+    sentences. Without <cache_dir> no results are kept in memory."""
+    fingerprint = fingerprint_rules(rules_order, rules_def)
+    if (fingerprint, runtime) not in LOADED:
+        LOADED[(fingerprint, runtime)] = CompiledRules(rules_order, rules_def, runtime)
+    compiled = LOADED[(fingerprint, runtime)]
+    if cache_dir is not None:
+        compiled.load_cache(cache_dir)
+    return compiled
+
+def fingerprint_rules(rules_order, rules_def):
+    """Return a sha1 hash of the rule set and of the code that computes the
+    rule output: the rule functions, their token versions, the Aho-Corasick
+    matcher, and this module"""
+    source = [inspect.getsource(module) for module in
+              [rule_functions, token_rules, aho_corasick, sys.modules[__name__]]]
+    for mainword in rules_order:
+        kwargs = rules_def[mainword]
+        source.append((mainword, sorted([(k, v.__name__ if callable(v) else repr(v)) for k, v in kwargs.items()])))
+    return hashlib.sha1(repr(source).encode('utf-8')).hexdigest()
+
+#Rule functions whose trigger word is not the mainword itself
+TRIGGER_WORDS = {'patent_handling':'patent', #mainword ' patent'
+                 'non_handling':'non'}
+
+class CompiledRules(object):
+    def __init__(self, rules_order, rules_def, runtime='string'):
+        """Variables:
+        <rules_order>: list of mainwords in the order the rules are applied
+        <rules_def>: dictionary where the keys are mainwords and the values
+            are dictionaries with the rule 'function' and its arguments
+        <runtime>: either 'string' to call the rule functions on the sentence
+            strings, 'token' to use the versions of the rule functions in
+            token_rules.py, which work on a TokenSentence, or 'column' to
+            apply each rule to all the sentences at once (see
+            self.apply_columns()). The output is the same either way, so the
+            cache of results is shared."""
+        assert runtime in ['string','token','column']
+        self.runtime = runtime
+        self.rules_order = rules_order
+        self.rules_def = rules_def
+        triggers = [] #distinct trigger words
+        trigger_ids = {}
+        #self.rules is a list of (trigger id, function, mainword, kwargs)
+        self.rules = []
+        for mainword in rules_order:
+            kwargs = rules_def[mainword]
+            func = kwargs['function']
+            trigger = TRIGGER_WORDS.get(func.__name__, mainword)
+            assert trigger.strip() != '', 'Rule triggers must not be whitespace'
+            if trigger not in trigger_ids:
+                trigger_ids[trigger] = len(triggers)
+                triggers.append(trigger)
+            self.rules.append((trigger_ids[trigger], func, mainword, kwargs))
+        self.triggers = triggers
+        self.automaton = aho_corasick.Automaton(triggers)
+        self.fingerprint = fingerprint_rules(rules_order, rules_def)
+        
+        #Cache of results: sentence --> output of self.apply(sentence). It is
+        #only filled when a cache is used (see apply_unique())
+        self.results = {}
+        self.cache_paths_loaded = set()
+        self.unsaved_results = {}
+    
+    def apply_unique(self, sentences, remember=False, apply_many=None):
+        """Return a dictionary where the keys are the unique sentences in the
+        list <sentences> and the values are the outputs of self.apply(),
+        which is only called for sentences that are not cached yet.
+        If <remember> is True, the new outputs are added to the cache
+        (to be saved by save_cache()). Otherwise they are only returned, so
+        that memory does not grow with the number of calls.
+        <apply_many> is an optional function used instead of
+        self.apply_many() for the new sentences, e.g. to run them in
+        worker processes."""
+        unique_sentences = list(dict.fromkeys(sentences))
+        new_sentences = [x for x in unique_sentences if x not in self.results]
+        if apply_many is None:
+            apply_many = self.apply_many
+        new_results = dict(zip(new_sentences, apply_many(new_sentences))) if len(new_sentences) > 0 else {}
+        if remember and len(new_results) > 0:
+            self.add_results(new_sentences, [new_results[x] for x in new_sentences])
+        return {x:(new_results[x] if x in new_results else self.results[x]) for x in unique_sentences}
+    
+    def apply_many(self, sentences):
+        """Return a list of the outputs of self.apply() for each sentence in
+        the list <sentences>"""
+        if self.runtime == 'column':
+            return self.apply_columns(sentences)
+        return [self.apply(sentence) for sentence in sentences]
+    
+    def add_results(self, sentences, outputs):
+        """Add results that were computed elsewhere (e.g. in a worker
+        process). <outputs> are the outputs of self.apply() for the
+        list <sentences>, in the same order."""
+        assert len(sentences)==len(outputs)
+        new_results = dict(zip(sentences, outputs))
+        self.results.update(new_results)
+        self.unsaved_results.update(new_results)
+    
+    # Results Cache #-----------------------------------------------------------
+    #The results are saved in shards: each call of save_cache() writes only
+    #the results added since the last call to a new file, so a run over many
+    #chunks of sentences does not rewrite all the earlier results every time
+    def load_cache(self, cache_dir):
+        """Load the results of every shard in <cache_dir> for this rule set
+        that was not loaded yet"""
+        if not os.path.isdir(cache_dir):
+            return
+        prefix = 'RuleResults_'+self.fingerprint+'_'
+        for filename in sorted(os.listdir(cache_dir)):
+            cache_path = os.path.join(cache_dir, filename)
+            if (filename.startswith(prefix) and filename.endswith('.pkl')
+                    and (cache_path not in self.cache_paths_loaded)):
+                with open(cache_path, 'rb') as f:
+                    self.results.update(pickle.load(f))
+                self.cache_paths_loaded.add(cache_path)
+    
+    def save_cache(self, cache_dir):
+        """Save the results that were added since the last call to a new
+        shard in <cache_dir>"""
+        if len(self.unsaved_results) == 0:
+            return
+        cache_path = self.cache_path(cache_dir, self.unsaved_results)
+        cache_files.save_pickle_atomically(self.unsaved_results, cache_path)
+        self.cache_paths_loaded.add(cache_path)
+        self.unsaved_results = {}
+    
+    def cache_path(self, cache_dir, shard_results):
+        """Return the path of the shard that holds <shard_results>. It is
+        named after the fingerprint of the rule set and a hash of the
+        sentences."""
+        shard_hash = hashlib.sha1('\n'.join(sorted(shard_results.keys())).encode('utf-8')).hexdigest()
+        return os.path.join(cache_dir, 'RuleResults_'+self.fingerprint+'_'+shard_hash+'.pkl')
+    
+    def apply(self, sentence):
+        """Apply the rules to <sentence> and return a tuple of (modified,
+        sentence). <modified> is True if any rule modified the sentence, and
+        <sentence> is the sentence as of the last modification. This is the
+        same as calling every rule in order with apply_rules_in_order()."""
+        if self.runtime == 'token':
+            return self.apply_tokens(sentence)
+        if self.runtime == 'column':
+            return self.apply_columns([sentence])[0]
+        present = self.automaton.find(sentence)
+        modified_any = False
+        recorded = sentence
+        for trigger_id, func, mainword, kwargs in self.rules:
+            if not present:
+                break
+            if trigger_id not in present:
+                continue
+            modified, new_sentence = func(sentence=sentence, mainword=mainword, **kwargs)
+            if new_sentence != sentence:
+                sentence = new_sentence
+                present = self.automaton.find(sentence)
+            if modified:
+                modified_any = True
+                recorded = sentence
+        return modified_any, recorded
+    
+    def apply_tokens(self, sentence):
+        """Same as self.apply() but with the rule functions of token_rules.py"""
+        sent = token_rules.TokenSentence(sentence)
+        present = self.automaton.find(sentence)
+        modified_any = False
+        recorded = sentence
+        for trigger_id, func, mainword, kwargs in self.rules:
+            if not present:
+                break
+            if trigger_id not in present:
+                continue
+            modified = token_rules.apply_rule(sent, func, mainword, kwargs)
+            if sent.text() != sentence:
+                sentence = sent.text()
+                present = self.automaton.find(sentence)
+            if modified:
+                modified_any = True
+                recorded = sentence
+        return modified_any, recorded
+    
+    def apply_columns(self, sentences):
+        """Same as self.apply() on each sentence in the list <sentences>, but
+        the rules are applied in order to all the sentences at once. The
+        delete, delete_mainword, and delete_part rules are applied with
+        pandas string operations on all the sentences that contain the
+        trigger word. The other rule functions are called on each of those
+        sentences."""
+        current = pd.Series(sentences, dtype='object')
+        recorded = current.copy()
+        modified_any = np.zeros(len(sentences), dtype='bool')
+        for trigger_id, func, mainword, kwargs in self.rules:
+            present = current.str.contains(self.triggers[trigger_id], regex=False).values
+            if not present.any():
+                continue
+            selected = current[present]
+            modified = np.ones(len(selected), dtype='bool')
+            if func is rule_functions.delete:
+                new_sentences = ['']*len(selected)
+            elif func is rule_functions.delete_mainword:
+                new_sentences = selected.str.replace(mainword, '', regex=False).values
+            elif func is rule_functions.delete_part and kwargs['delete_part'] in ['after','before']:
+                #escaped so that str.split() gives the same output as
+                #sentence.split(mainword), i.e. non-overlapping occurrences
+                if kwargs['delete_part'] == 'after':
+                    new_sentences = selected.str.split(re.escape(mainword), n=1).str[0].values
+                else:
+                    new_sentences = selected.str.split(re.escape(mainword)).str[-1].values
+            else:
+                outputs = [func(sentence=sentence, mainword=mainword, **kwargs) for sentence in selected.values.tolist()]
+                modified = np.array([x[0] for x in outputs], dtype='bool')
+                new_sentences = [x[1] for x in outputs]
+            current[present] = new_sentences
+            changed = present.copy()
+            changed[present] = modified
+            recorded[changed] = current[changed]
+            modified_any = modified_any | changed
+        return [(bool(x), y) for x, y in zip(modified_any.tolist(), recorded.values.tolist())]
+
+def apply_rules_in_order(sentence, rules_order, rules_def):
+    """Reference implementation of CompiledRules.apply(): call every rule in
+    <rules_order> on <sentence>, one after the other"""
+    modified_any = False
+    recorded = sentence
+    for mainword in rules_order:
+        func = rules_def[mainword]['function']
+        kwargs = rules_def[mainword]
+        modified, sentence = func(sentence=sentence,mainword=mainword,**kwargs)
+        if modified:
+            modified_any = True
+            recorded = sentence
+    return modified_any, recorded
@@ -0,0 +1,265 @@
+#token_rules.py
+#Copyright (c) 2020 Rachel Lea Ballantyne Draelos
+
+#MIT License
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE
+
+import re
+
+from src.rules import rule_functions
+
+"""Alternative runtime for the rule functions in rule_functions.py.
+
+The functions in rule_functions.py work on the raw sentence string, so every
+rule call splits, joins, and concatenates new strings. Here a sentence is a
+TokenSentence, which records which parts of the original sentence are kept
+(plus the few spaces and words that the rules insert), and the rule functions
+below only update the kept parts. The text of the sentence is rebuilt from the
+kept parts when it is needed, and the words of the sentence (with their
+character offsets) are found once per version of the sentence.
+
+Every function below gives exactly the same output as the rule function of the
+same name, including the quirks of the string implementation (e.g. mainwords
+are matched as substrings, not as whole words)."""
+
+#Words of a sentence, i.e. the same as the output of sentence.split()
+WORD = re.compile(r'\S+')
+
+class TokenSentence(object):
+    def __init__(self, sentence):
+        """Variables:
+        <sentence>: the original sentence, a string"""
+        self.original = sentence
+        #The sentence is the concatenation of self.pieces. Each piece is either
+        #a tuple (start, end) of a kept part of the original sentence, or a
+        #string that was inserted by a rule.
+        self.pieces = [(0, len(sentence))]
+        self._text = sentence
+        self._tokens = None
+    
+    def text(self):
+        """Return the current sentence as a string"""
+        if self._text is None:
+            self._text = ''.join([self.original[piece[0]:piece[1]] if isinstance(piece, tuple) else piece for piece in self.pieces])
+        return self._text
+    
+    def tokens(self):
+        """Return a list of (start, end) character offsets of the words of the
+        current sentence"""
+        if self._tokens is None:
+            self._tokens = [match.span() for match in WORD.finditer(self.text())]
+        return self._tokens
+    
+    def words(self):
+        text = self.text()
+        return [text[start:end] for start, end in self.tokens()]
+    
+    def pieces_between(self, start, end):
+        """Return the pieces that make up self.text()[<start>:<end>]"""
+        selected = []
+        offset = 0
+        for piece in self.pieces:
+            if isinstance(piece, tuple):
+                length = piece[1]-piece[0]
+            else:
+                length = len(piece)
+            low = max(start, offset)
+            high = min(end, offset+length)
+            if low < high:
+                if isinstance(piece, tuple):
+                    selected.append((piece[0]+low-offset, piece[0]+high-offset))
+                else:
+                    selected.append(piece[low-offset:high-offset])
+            offset += length
+            if offset >= end:
+                break
+        return selected
+    
+    def keep(self, pieces):
+        """Replace the current sentence with the concatenation of <pieces>"""
+        self.pieces = pieces
+        self._text = None
+        self._tokens = None
+
+
+#################
+# Rule Handling #---------------------------------------------------------------
+#################
+#Each function takes a TokenSentence <sent> and the same arguments as the
+#rule function of the same name. It updates <sent> in place and returns True if
+#the rule function would have returned True.
+
+def delete_part(sent, delete_part, mainword, **kwargs):
+    text = sent.text()
+    start = text.find(mainword)
+    if start == -1:
+        return False
+    if delete_part == 'after':
+        sent.keep(sent.pieces_between(0, start))
+        return True
+    if delete_part == 'before':
+        #keep everything after the last occurrence that sentence.split()
+        #would find (occurrences do not overlap)
+        end = start+len(mainword)
+        start = text.find(mainword, end)
+        while start != -1:
+            end = start+len(mainword)
+            start = text.find(mainword, end)
+        sent.keep(sent.pieces_between(end, len(text)))
+        return True
+
+def delete_part_until(sent, delete_part, mainword, until_hit, **kwargs):
+    text = sent.text()
+    start = text.find(mainword)
+    if start == -1:
+        return False
+    end = start+len(mainword)
+    #the part between the first and the second occurrence of the mainword
+    #is sentence.split(mainword)[1]
+    next_start = text.find(mainword, end)
+    if next_start == -1:
+        next_start = len(text)
+    if delete_part == 'after':
+        idx = next_start-end
+        for u in until_hit:
+            d = text.find(u, end, next_start)
+            if d != -1:
+                d = d-end
+            if d < idx and d!=-1:
+                idx = d
+        sent.keep(sent.pieces_between(0, start)+[' ']+sent.pieces_between(end+idx, next_start))
+        return True
+    if delete_part == 'before':
+        idx = 0
+        for u in until_hit:
+            d = text.find(u, 0, start)+len(u)
+            if d > idx and d!=-1:
+                idx = d
+        sent.keep(sent.pieces_between(0, min(idx, start))+sent.pieces_between(end, next_start))
+        return True
+
+def delete_entire_unless_immediate(sent, mainword, position, wrange, unless_in, **kwargs):
+    text = sent.text()
+    start = text.find(mainword)
+    if start == -1:
+        return False
+    if position == 'after':
+        if sent.words()[-1]==mainword.strip():
+            sent.keep([])
+            return True
+        end = start+len(mainword)
+        next_start = text.find(mainword, end)
+        if next_start == -1:
+            next_start = len(text)
+        possible_save_words = ' '.join([match.group() for match in WORD.finditer(text, end, next_start)][0:wrange])
+    elif position == 'before':
+        if sent.words()[0]==mainword.strip():
+            sent.keep([])
+            return True
+        possible_save_words = ' '.join([match.group() for match in WORD.finditer(text, 0, start)][-1*wrange:])
+    for u in unless_in:
+        if u in possible_save_words:
+            return False
+    sent.keep([])
+    return True
+
+def non_handling(sent, mainword, **kwargs):
+    text = sent.text()
+    if 'non' not in text:
+        return False
+    words = sent.words()
+    if ' non ' in text: #i.e., standalone word ' non '
+        idx = words.index('non')
+        kept = list(range(0, idx))+list(range(idx+2, len(words)))
+    else: #non is prefixing another word
+        #same result as removing the words from the list while iterating
+        #over it, as the string implementation does
+        kept = list(range(len(words)))
+        i = 0
+        while i < len(kept):
+            word = words[kept[i]]
+            if 'non' in word:
+                kept.remove([j for j in kept if words[j]==word][0])
+            i += 1
+    tokens = sent.tokens()
+    pieces = [' ']
+    for position, j in enumerate(kept):
+        if position > 0:
+            pieces.append(' ')
+        pieces += sent.pieces_between(*tokens[j])
+    pieces.append(' ')
+    sent.keep(pieces)
+    return True
+
+def patent_handling(sent, mainword, **kwargs):
+    assert mainword==' patent'
+    if 'patent' not in sent.text():
+        return False
+    if sent.words()[0]=='patent':
+        return delete_part_until(sent, delete_part = 'after',mainword = 'patent', until_hit = ['status','with'])
+    else: #patent is at the middle or the end of the sentence
+        return delete_part(sent, delete_part = 'before',mainword = 'patent')
+
+def clear_handling(sent, mainword, **kwargs):
+    assert mainword==' clear'
+    if ' clear' not in sent.text():
+        return False
+    changed1 = delete_part(sent, delete_part='before',mainword=mainword)
+    sent.keep([' clear ']+sent.pieces) #must keep word 'clear' at the beginning of the fragment so that the next step can work
+    changed2 = delete_part_until(sent, delete_part='after',mainword=mainword,until_hit=['status'])
+    return (changed1 or changed2)
+
+def subcentimeter_handling(sent, mainword, **kwargs):
+    assert mainword==' subcentimeter'
+    text = sent.text()
+    start = text.find(mainword)
+    if start == -1:
+        return False
+    #'node' can't overlap the mainword, so this is the same as checking for
+    #'node' in ' '.join(sentence.split(mainword)[1:])
+    if text.find('node', start+len(mainword)) != -1:
+        pre_idx = text.rfind(' subcentimeter')
+        post_idx = text.rfind('node')+len('node')
+        sent.keep(sent.pieces_between(0, pre_idx)+sent.pieces_between(post_idx, len(text)))
+        return True
+    else:
+        return False
+
+#Rule functions that have a version in this module. The other rule functions
+#are run on the text of the sentence by apply_rule().
+TOKEN_FUNCTIONS = {rule_functions.delete_part:delete_part,
+                   rule_functions.delete_part_until:delete_part_until,
+                   rule_functions.delete_entire_unless_immediate:delete_entire_unless_immediate,
+                   rule_functions.non_handling:non_handling,
+                   rule_functions.patent_handling:patent_handling,
+                   rule_functions.clear_handling:clear_handling,
+                   rule_functions.subcentimeter_handling:subcentimeter_handling}
+
+def apply_rule(sent, func, mainword, kwargs):
+    """Apply the rule function <func> with <mainword> and <kwargs> to the
+    TokenSentence <sent> and return <modified>, like the first output of
+    <func>"""
+    if func in TOKEN_FUNCTIONS:
+        return TOKEN_FUNCTIONS[func](sent, mainword=mainword, **kwargs)
+    text = sent.text()
+    modified, new_text = func(sentence=text, mainword=mainword, **kwargs)
+    if new_text != text:
+        sent.keep([new_text])
+    return modified
@@ -23,15 +23,24 @@
 
 import os
 import copy
-import pickle
 import datetime
 import pandas as pd
 
-from . import load, sentence_rules, sentence_classifier, term_search, visualizations
+from . import load, label_store, sentence_rules, sentence_classifier, sentence_cascade, term_search, visualizations
+
+#Suggested directory for the optional caches that are shared across runs (see
+#the <cache_dir> argument of generate_labels())
+CACHE_DIR = os.path.join('results','.cache')
+
+#Directory in which the trained sentence classifiers of the 'hybrid' variant are
+#saved so that later runs with the same training data can reuse them
+MODEL_REGISTRY_DIR = os.path.join('results','sentence_classifiers')
 
 def generate_labels(train_data_raw, test_data_raw, predict_data_raw,
                     dataset_descriptor, sarle_variant, ambiguities,
-                    run_locdis_checks):
+                    run_locdis_checks, workers=1, previous_results_dir=None,
+                    classifier_backend='fasttext', cache_dir=None,
+                    rules_runtime='string'):
     """Generate a matrix of abnormality x location labels for each
     free-text radiology report in the dataset.
     
@@ -48,18 +57,42 @@ def generate_labels(train_data_raw, test_data_raw, predict_data_raw,
         a report-level abnormality ground truth by modifying the relevant code.
         The <dataset_descriptor> is used in output file names, so please choose
         something without spaces in it.
-    <sarle_variant> is either 'hybrid' or 'rules'.
+    <sarle_variant> is either 'hybrid', 'rules', or 'cascade'.
         If 'hybrid' then a Fasttext sentence classifier will be used to filter
         out normal sentences and keep only abnormal sentences.
         If 'rules' then a rule-based method will be used to filter out normal
         phrases and keep only abnormal phrases. Different rules will be applied
         depending on whether the data set is Duke CT or OpenI.
         'rules' outperforms 'hybrid' on the Duke CT dataset.
+        If 'cascade' then the rules are applied first and only the sentences
+        that the rules do not resolve are classified by the sentence
+        classifier (see sentence_cascade.CascadeSentences).
     <ambiguities> is either 'pos' or 'neg' which determines whether
         ambiguous findings are kept in the sentences (and thus marked positive) 
         or deleted from the sentences (and thus marked negative).
     <run_locdis_checks> is either True or False. If True then run sanity
-        checks based on allowed abnormality x location combos."""
+        checks based on allowed abnormality x location combos.
+    <workers> is the number of processes used for the rules step (if
+        sarle_variant is 'rules') and for the term search step. The default
+        of 1 runs everything in the current process.
+    <previous_results_dir> is optional. If it is the results_dir of a
+        previous run with the same configuration, then the term search is run
+        incrementally: only new reports and reports whose sentences changed
+        are labeled, and the labels of the other reports are reused. The
+        output files still contain all the reports.
+    <classifier_backend> is either 'fasttext' or 'hashing', the sentence
+        classifier used by the 'hybrid' and 'cascade' variants (see
+        sentence_classifier.ClassifySentences).
+    <cache_dir> is optional. If provided (e.g. CACHE_DIR), it is the
+        directory for the caches that are shared across runs: the rule
+        output for each unique sentence, the sentence classifier
+        predictions, and the compiled vocabularies. By default nothing is
+        cached.
+    <rules_runtime> is either 'string', 'token', or 'column', the
+        implementation of the rule functions used by the 'rules' and
+        'cascade' variants and by the ambiguity filter of the 'hybrid'
+        variant (see rules.compiled_rules.CompiledRules). The labels are
+        the same either way."""
     #Run sanity checks and set up results dirs
     setup = [sarle_variant, dataset_descriptor, ambiguities, run_locdis_checks]
     sanity_check_configuration(*setup)
@@ -78,7 +111,9 @@ def generate_labels(train_data_raw, test_data_raw, predict_data_raw,
 
     #Step 1: Sentence/Phrase Classification
     if sarle_variant == 'hybrid': #Sentence Classifier, Fasttext approach
-        m = sentence_classifier.ClassifySentences(train_data, test_data, predict_data, sent_class_dir, ambiguities)
+        m = sentence_classifier.ClassifySentences(train_data, test_data, predict_data, sent_class_dir, ambiguities,
+                        prediction_cache_dir=cache_dir, model_registry_dir=MODEL_REGISTRY_DIR,
+                        backend=classifier_backend, rules_runtime=rules_runtime)
         m.run_all()
         train_data = m.train_data
         test_data = m.test_data
@@ -86,20 +121,68 @@ def generate_labels(train_data_raw, test_data_raw, predict_data_raw,
     
     elif sarle_variant == 'rules': #Rule-based approach
         rules_to_use = decide_rules_to_use(dataset_descriptor, ambiguities)
-        train_data = sentence_rules.ApplyRules(train_data, 'train', rules_to_use).data_processed
-        test_data = sentence_rules.ApplyRules(test_data, 'test', rules_to_use).data_processed
-        predict_data = sentence_rules.ApplyRules(predict_data, 'predict', rules_to_use).data_processed
+        train_data = sentence_rules.ApplyRules(train_data, 'train', rules_to_use, cache_dir, workers, rules_runtime).data_processed
+        test_data = sentence_rules.ApplyRules(test_data, 'test', rules_to_use, cache_dir, workers, rules_runtime).data_processed
+        predict_data = sentence_rules.ApplyRules(predict_data, 'predict', rules_to_use, cache_dir, workers, rules_runtime).data_processed
+    
+    elif sarle_variant == 'cascade': #Rules first, then Sentence Classifier
+        rules_to_use = decide_rules_to_use(dataset_descriptor, ambiguities)
+        m = sentence_cascade.CascadeSentences(train_data, test_data, predict_data, sent_class_dir,
+                        ambiguities, rules_to_use, cache_dir=cache_dir,
+                        model_registry_dir=MODEL_REGISTRY_DIR,
+                        classifier_backend=classifier_backend, workers=workers,
+                        rules_runtime=rules_runtime)
+        m.run_all()
+        train_data = m.train_data
+        test_data = m.test_data
+        predict_data = m.predict_data
     
     #Step 2: Term Search
-    term_search.RadLabel(train_data, 'train', dataset_descriptor, term_search_dir, run_locdis_checks)
-    term_search.RadLabel(test_data, 'test', dataset_descriptor, term_search_dir, run_locdis_checks)
-    term_search.RadLabel(predict_data, 'predict', dataset_descriptor, term_search_dir, run_locdis_checks)
+    if previous_results_dir is not None:
+        previous_term_search_dir = os.path.join(previous_results_dir, '1_term_search')
+    else:
+        previous_term_search_dir = None
+    term_search_options = {'workers':workers,
+                           'previous_term_search_dir':previous_term_search_dir,
+                           'vocabulary_cache_dir':cache_dir}
+    term_search.RadLabel(train_data, 'train', dataset_descriptor, term_search_dir, run_locdis_checks, **term_search_options)
+    term_search.RadLabel(test_data, 'test', dataset_descriptor, term_search_dir, run_locdis_checks, **term_search_options)
+    term_search.RadLabel(predict_data, 'predict', dataset_descriptor, term_search_dir, run_locdis_checks, **term_search_options)
     
     if ((dataset_descriptor in ['duke_ct_2019_09_25','duke_ct_2020_03_17']) and (not predict_data.empty)):
         term_search.combine_imgtrain_files(term_search_dir)
     print('Done')
 
 
+def generate_predict_labels_in_chunks(predict_chunks, dataset_descriptor,
+                                      ambiguities, run_locdis_checks, workers=1,
+                                      cache_dir=None, rules_runtime='string'):
+    """Generate labels for a predict set that is too large to load into
+    memory at once, using the 'rules' variant of SARLE.
+    <predict_chunks> is an iterable of dataframes with the same format as
+        <predict_data_raw> in generate_labels(), in which the sentences of
+        each report are all in the same dataframe, e.g. the output of
+        term_search.read_csv_in_report_chunks().
+    The other variables are as described in generate_labels(). Only the
+    'rules' variant is supported because the 'hybrid' variant trains its
+    sentence classifier on the train set.
+    By default nothing is cached, so peak memory depends only on the chunk
+    size. If a <cache_dir> is given, the rule output of every unique
+    sentence of the whole predict set is kept in memory (and saved to the
+    cache), so memory grows with the number of unique sentences."""
+    setup = ['rules', dataset_descriptor, ambiguities, run_locdis_checks]
+    sanity_check_configuration(*setup)
+    results_dir, sent_class_dir, term_search_dir = configure_results_dirs(*setup)
+    rules_to_use = decide_rules_to_use(dataset_descriptor, ambiguities)
+    #Apply the rules lazily, one chunk at a time
+    processed_chunks = (sentence_rules.ApplyRules(chunk, 'predict', rules_to_use, cache_dir, workers, rules_runtime).data_processed
+                        for chunk in predict_chunks)
+    term_search.term_search_chunks(processed_chunks, 'predict', dataset_descriptor,
+                        term_search_dir, run_locdis_checks, workers=workers,
+                        vocabulary_cache_dir=cache_dir)
+    print('Done')
+
+
 def generate_visualizations(dataset_descriptor, results_dir):
     """Make visualizations that summarize the extracted labels"""
     assert dataset_descriptor == 'duke_ct', 'Visualizations only tested for dataset_descriptor = duke_ct'
@@ -121,7 +204,7 @@ def generate_visualizations(dataset_descriptor, results_dir):
         viz_dir_setname = os.path.join(viz_dir,setname)
         #Location x Disease Summary:
         missing = pd.read_csv(os.path.join(term_search_dir, setname+'_Missingness.csv'), header=0, index_col = 0)
-        out_bin = pickle.load(open(os.path.join(term_search_dir, setname+'_BinaryLabels.pkl'), 'rb'))
+        out_bin = label_store.load_binary_labels(os.path.join(term_search_dir, setname))
         visualizations.LocationDiseaseSummary(setname, term_search_dir, viz_dir_setname, out_bin, missing)
         
         #Abnormalities per CT Summary
@@ -134,7 +217,7 @@ def generate_visualizations(dataset_descriptor, results_dir):
 def sanity_check_configuration(sarle_variant, dataset_descriptor, ambiguities, 
                                run_locdis_checks):
     """Sanity check the requested configuration"""
-    assert sarle_variant in ['hybrid','rules']
+    assert sarle_variant in ['hybrid','rules','cascade']
     
     if dataset_descriptor in ['duke_ct_2019_09_25','openi_cxr']:
         print(dataset_descriptor,'report-level ground truth is available, '\
@@ -176,7 +259,7 @@ def configure_results_dirs(sarle_variant, dataset_descriptor, ambiguities,
         os.mkdir(results_dir)
     print('Results in',results_dir)
 
-    if sarle_variant=='hybrid':
+    if sarle_variant in ['hybrid','cascade']:
         sent_class_dir = os.path.join(results_dir, '0_sentences')
         if not os.path.isdir(sent_class_dir):
             os.mkdir(sent_class_dir)
@@ -0,0 +1,143 @@
+#sentence_cascade.py
+#Copyright (c) 2020 Rachel Lea Ballantyne Draelos
+
+#MIT License
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE
+
+import re
+import pandas as pd
+
+from src import evaluation, sentence_rules, sentence_classifier
+
+#Sentences that contain any of these are sent to the classifier even if the
+#rules deleted them entirely, because the rules are less reliable on sentences
+#that express uncertainty or that combine a finding with a negation (e.g.
+#'borderline cardiomegaly without acute disease')
+UNCERTAINTY_WORDS = ['possibl','probabl','likely','suspicious','concerning',
+                     'cannot be excluded','not excluded','versus',' vs ','andor',
+                     'may ','suggest','question','borderline','otherwise',
+                     'however','although','without',' with ','not ']
+
+class CascadeSentences(object):
+    """Rules first, then the classifier for the sentences that the rules
+    leave undecided.
+    
+    The rules are applied to all sentences. A sentence that the rules delete
+    entirely is healthy, and does not need to be classified, unless it contains
+    one of the uncertainty words. All the other sentences (the ones that the
+    rules did not resolve, or only resolved partly) are classified by a
+    sentence classifier trained on the train set, and the sentence is sick if
+    the classifier says so. For sick sentences the output of the rules is kept
+    for the term search, so that e.g. negated findings are still removed.
+    
+    The final results are stored in the dataframes train_data, test_data,
+    and predict_data, in the same format as the output of
+    sentence_rules.ApplyRules"""
+    def __init__(self, train_data, test_data, predict_data, results_dir,
+                 ambiguities, rules_to_use, uncertainty_words=UNCERTAINTY_WORDS,
+                 cache_dir=None, model_registry_dir=None,
+                 classifier_backend='fasttext', workers=1, rules_runtime='string'):
+        """Variables:
+        <results_dir>: path to directory in which the classifier results will
+            be saved
+        <ambiguities>: either 'pos' or 'neg'
+        <rules_to_use>: the rules to apply, see sentence_rules.ApplyRules
+        <uncertainty_words>: list of strings. Sentences that contain any of
+            them are always classified.
+        <cache_dir>: optional path to a directory for the rule results cache
+            and the prediction cache
+        <model_registry_dir>: optional path to the model registry of
+            sentence_classifier.ClassifySentences
+        <classifier_backend>: either 'fasttext' or 'hashing'
+        <workers>: int, number of processes used to apply the rules
+        <rules_runtime>: either 'string', 'token', or 'column', the
+            implementation of the rule functions (see
+            compiled_rules.CompiledRules)"""
+        self.train_data = train_data
+        self.test_data = test_data
+        self.predict_data = predict_data
+        self.results_dir = results_dir
+        self.ambiguities = ambiguities
+        self.rules_to_use = rules_to_use
+        self.uncertainty_words = uncertainty_words
+        self.cache_dir = cache_dir
+        self.model_registry_dir = model_registry_dir
+        self.classifier_backend = classifier_backend
+        self.workers = workers
+        self.rules_runtime = rules_runtime
+        #number of sentences in each set that were sent to the classifier
+        self.classified_counts = {}
+        print('Running sentence_cascade')
+    
+    def run_all(self):
+        #The classifier is trained on the original train sentences
+        self.classifier = sentence_classifier.ClassifySentences(self.train_data.copy(),
+                self.test_data.copy(), pd.DataFrame(), self.results_dir, self.ambiguities,
+                prediction_cache_dir=self.cache_dir, model_registry_dir=self.model_registry_dir,
+                backend=self.classifier_backend, rules_runtime=self.rules_runtime)
+        self.classifier.train_classifier()
+        self.train_data = self._cascade('train', self.train_data)
+        self.test_data = self._cascade('test', self.test_data)
+        self.predict_data = self._cascade('predict', self.predict_data)
+        self.classifier.finish()
+    
+    def _cascade(self, setname, data):
+        """Apply the rules to <data> and then the classifier to the sentences
+        that the rules did not decide"""
+        data = sentence_rules.ApplyRules(data, setname, self.rules_to_use,
+                        self.cache_dir, self.workers, self.rules_runtime).data_processed
+        if data.empty:
+            return data
+        #OriginalSentence was padded with one space on each side by ApplyRules
+        original_sentences = data['OriginalSentence'].str[1:-1]
+        undecided = (data['PredLabel'] == 1).values
+        if len(self.uncertainty_words) > 0:
+            pattern = '|'.join([re.escape(x) for x in self.uncertainty_words])
+            undecided = undecided | data['OriginalSentence'].str.contains(pattern).values
+        self.classified_counts[setname] = int(undecided.sum())
+        print('*** '+setname+' cascade ***')
+        print('\tSentences decided by the rules:',(~undecided).sum(),
+              'Sentences sent to the classifier:',undecided.sum())
+        if undecided.any():
+            to_classify = pd.DataFrame({'Sentence':original_sentences[undecided]})
+            if 'BinLabel' in data.columns:
+                to_classify['BinLabel'] = data['BinLabel'][undecided]
+            to_classify = self.classifier.predict(to_classify, setname)
+            pred_labels = data['PredLabel'].values.copy()
+            pred_probs = data['PredProb'].values.astype('float')
+            pred_labels[undecided] = to_classify['PredLabel'].values
+            pred_probs[undecided] = to_classify['PredProb'].values
+            #If the rules deleted a sentence that the classifier says is sick
+            #then the term search gets the original sentence
+            sentences = data['Sentence'].values.copy()
+            restore = (pred_labels == 1) & (sentences == '')
+            sentences[restore] = original_sentences.values[restore]
+            data['Sentence'] = sentences
+            data['PredLabel'] = pred_labels
+            data['PredProb'] = pred_probs
+        
+        #Report performance of the whole cascade
+        #This is within a 'try' block because it will only work if sentence
+        #level ground truth is provided for all sentences
+        try:
+            evaluation.report_sentence_level_eval(data, setname, 'Cascade')
+        except:
+            pass
+        return data
@@ -22,6 +22,9 @@
 #SOFTWARE
 
 import os
+import pickle
+import shutil
+import hashlib
 
 import numpy as np
 
@@ -31,22 +34,49 @@ except:
     #fasttext not available on Windows
     print('Notification: fasttext not imported')
 
-from src import evaluation, sentence_rules
-from src.rules import rules_cxr
+from src import evaluation, hashing_classifier, cache_files
+from src.rules import rules_cxr, compiled_rules
+
+#Number of sentences passed to the Fasttext model at a time
+PREDICTION_BATCH_SIZE = 10000
 
 class ClassifySentences(object):
     """Train (training set), evaluate (test set), and use (predict set)
-    a Fasttext model that classifies individual radiology report sentences as
-    'sick' or 'healthy'.
+    a Fasttext model (or a hashing_classifier.HashingClassifier) that
+    classifies individual radiology report sentences as 'sick' or 'healthy'.
     
     The final results are stored in the dataframes train_data, test_data,
     and predict_data."""
     def __init__(self, train_data, test_data, predict_data,
-                 results_dir, ambiguities, save_model_files=False):
+                 results_dir, ambiguities, save_model_files=False,
+                 prediction_cache_dir=None, model_registry_dir=None,
+                 model_params=None, pretrained_vectors=False, backend='fasttext',
+                 rules_runtime='string'):
         """Variables:
         <results_dir>: path to directory in which results will be saved
         <ambiguities>: if 'neg' then apply a rule-based ambiguity filter.
-        <save_model_files>: bool. If True, save the model files."""
+        <save_model_files>: bool. If True, save the model files.
+        <prediction_cache_dir>: optional path to a directory in which the
+            predictions for each unique sentence are cached across runs. The
+            cache is specific to the model file, so it is only reused when
+            the same model is used again.
+        <model_registry_dir>: optional path to a directory in which trained
+            classifiers are saved, keyed by a hash of the training data, the
+            Fasttext hyperparameters, and <pretrained_vectors>. If a classifier
+            for the same configuration was already saved, it is loaded
+            instead of trained.
+        <model_params>: optional dict of hyperparameters passed to
+            fasttext.train_supervised() (e.g. {'epoch':25}) or to
+            HashingClassifier() (e.g. {'C':1.0}), depending on <backend>
+        <pretrained_vectors>: bool. If True, a skipgram model is trained on
+            the training sentences and its word vectors are used as the
+            pretrained vectors of the classifier. Fasttext backend only.
+        <backend>: either 'fasttext' or 'hashing'. 'hashing' uses a
+            HashingClassifier, which is trained and run in memory and does
+            not need the fasttext package.
+        <rules_runtime>: either 'string', 'token', or 'column', the
+            implementation of the rule functions used by the ambiguity filter
+            (see compiled_rules.CompiledRules)"""
         self.train_data = train_data
         self.test_data = test_data
         self.predict_data = predict_data
@@ -58,11 +88,41 @@ class ClassifySentences(object):
         self.results_dir = results_dir
         self.ambiguities = ambiguities
         self.save_model_files = save_model_files
+        self.prediction_cache_dir = prediction_cache_dir
+        self.model_registry_dir = model_registry_dir
+        self.model_params = model_params if model_params is not None else {}
+        self.pretrained_vectors = pretrained_vectors
+        self.backend = backend
+        assert self.backend in ['fasttext','hashing']
+        self.rules_runtime = rules_runtime
         print('Running sentence_classifier')
         
     def run_all(self):
-        self._prepare_data()
-        self._run_fasttext_model()
+        self.train_classifier()
+        self._predict_all_sets()
+        self.finish()
+    
+    def train_classifier(self):
+        """Train (or load) the classifier and report its performance on the
+        test set"""
+        if self.backend == 'fasttext':
+            self._prepare_data()
+            self._run_fasttext_model()
+        elif self.backend == 'hashing':
+            self._run_hashing_model()
+        self._load_prediction_cache()
+    
+    def predict(self, data, setname):
+        """Return <data> with the predicted labels and probabilities of the
+        trained classifier added. Used to run the classifier on data other
+        than self.train_data, self.test_data, and self.predict_data."""
+        return self._get_preds_and_perf(setname, data)
+    
+    def finish(self):
+        """Save the prediction cache and clean up the model files"""
+        self._save_prediction_cache()
+        if self.backend == 'fasttext':
+            self._clean_up()
     
     # Data Handling #-----------------------------------------------------------
     def _prepare_data(self):
@@ -87,25 +147,91 @@ class ClassifySentences(object):
     
     # Fasttext Model #----------------------------------------------------------
     def _run_fasttext_model(self):
-        """Use the prepared train and test data to run the fasttext model"""
-        model = fasttext.train_unsupervised(os.path.join(self.results_dir,'fasttext_train_set.txt'), model='skipgram')
-        model.save_model(os.path.join(self.results_dir,'skipgram_model.bin'))
-        self.classifier = fasttext.train_supervised(os.path.join(self.results_dir, 'fasttext_train_set.txt'))
-        self.classifier.save_model(os.path.join(self.results_dir,'classifier.bin'))
+        """Use the prepared train and test data to train the fasttext model"""
+        self._train_or_load_classifier()
+        self.model_hash = hash_file(os.path.join(self.results_dir,'classifier.bin'))
         result = self.classifier.test(os.path.join(self.results_dir, 'fasttext_test_set.txt'))
         #result is a tuple (N, precision, recall)
         print('(N, P@1, R@1)=',result)
+    
+    def _predict_all_sets(self):
+        """Add the predictions of self.classifier to the train, test, and
+        predict data and apply the ambiguity filter"""
         self.train_data = self._get_preds_and_perf('train',self.train_data)
         self.test_data = self._get_preds_and_perf('test',self.test_data)
         if not self.predict_data.empty:
             self.predict_data = self._get_preds_and_perf('predict',self.predict_data)
-        self._clean_up()
         
         #ambiguity filter:
         if self.ambiguities == 'neg':
-            self.train_data = sentence_rules.apply_all_rules(self.train_data, rules_cxr.AMB_ORDER, rules_cxr.AMB_DEF)
-            self.test_data = sentence_rules.apply_all_rules(self.test_data, rules_cxr.AMB_ORDER, rules_cxr.AMB_DEF)
+            self.train_data = self._apply_ambiguity_filter(self.train_data)
+            self.test_data = self._apply_ambiguity_filter(self.test_data)
+            if not self.predict_data.empty:
+                self.predict_data = self._apply_ambiguity_filter(self.predict_data)
     
+    def _apply_ambiguity_filter(self, data):
+        """Return <data> with the ambiguous parts of the sentences (e.g.
+        'pneumonia is not excluded') deleted by the rules in
+        rules_cxr.AMB_DEF, so that the term search marks them negative"""
+        compiled = compiled_rules.load_compiled_rules(rules_cxr.AMB_ORDER,
+                        rules_cxr.AMB_DEF, runtime=self.rules_runtime)
+        #pad with spaces so that the rules work at the beginning of words
+        sentences = [' '+x+' ' for x in data['Sentence'].values.tolist()]
+        results = compiled.apply_unique(sentences)
+        data['Sentence'] = [' '.join(results[x][1].split()) for x in sentences]
+        return data
+    
+    def _train_or_load_classifier(self):
+        """Set self.classifier to the classifier saved in the model registry
+        for this training data and configuration if there is one, or else
+        train it (and save it in the model registry). Either way the
+        classifier is saved to classifier.bin in self.results_dir."""
+        train_path = os.path.join(self.results_dir,'fasttext_train_set.txt')
+        classifier_path = os.path.join(self.results_dir,'classifier.bin')
+        registry_path = None
+        if self.model_registry_dir is not None:
+            model_key = fingerprint_training(hash_file(train_path), self.model_params, self.pretrained_vectors)
+            registry_path = os.path.join(self.model_registry_dir, model_key, 'classifier.bin')
+        if (registry_path is not None) and os.path.isfile(registry_path):
+            print('Loading saved classifier',registry_path)
+            shutil.copyfile(registry_path, classifier_path)
+            self.classifier = fasttext.load_model(classifier_path)
+            return
+        params = dict(self.model_params)
+        if self.pretrained_vectors:
+            model = fasttext.train_unsupervised(train_path, model='skipgram')
+            model.save_model(os.path.join(self.results_dir,'skipgram_model.bin'))
+            vectors_path = os.path.join(self.results_dir,'skipgram_vectors.vec')
+            save_word_vectors(model, vectors_path)
+            params['pretrainedVectors'] = vectors_path
+            params['dim'] = model.get_dimension()
+        self.classifier = fasttext.train_supervised(train_path, **params)
+        self.classifier.save_model(classifier_path)
+        if registry_path is not None:
+            cache_files.copy_file_atomically(classifier_path, registry_path)
+    
+    # Hashing Model #-----------------------------------------------------------
+    def _run_hashing_model(self):
+        """Train (or load from the model registry) a HashingClassifier on the
+        train data in memory"""
+        sentences = self.train_data['Sentence'].values.tolist()
+        labels = self.train_data['Label'].values.tolist()
+        registry_path = None
+        if self.model_registry_dir is not None:
+            model_key = fingerprint_training(hash_sentences(sentences, labels), self.model_params, 'hashing')
+            registry_path = os.path.join(self.model_registry_dir, model_key, 'hashing_classifier.pkl')
+        if (registry_path is not None) and os.path.isfile(registry_path):
+            print('Loading saved classifier',registry_path)
+            self.classifier = pickle.load(open(registry_path, 'rb'))
+        else:
+            self.classifier = hashing_classifier.HashingClassifier(**self.model_params).train(sentences, labels)
+            if registry_path is not None:
+                cache_files.save_pickle_atomically(self.classifier, registry_path)
+        self.model_hash = hashlib.sha1(pickle.dumps(self.classifier)).hexdigest()
+        result = self.classifier.test(self.test_data['Sentence'].values.tolist(), self.test_data['Label'].values.tolist())
+        print('(N, P@1, R@1)=',result)
+    
+    # Predictions #-------------------------------------------------------------
     def _get_preds_and_perf(self, setname, data):
         """Report overall performance and save binary labels, predicted
         labels, and predicted probabilities in <data>"""
@@ -114,40 +240,100 @@ class ClassifySentences(object):
         data = self._extract_predictions(data)
         
         #Report performance
-        evaluation.report_sentence_level_eval(data, setname, 'Fasttext')
+        evaluation.report_sentence_level_eval(data, setname, {'fasttext':'Fasttext','hashing':'Hashing'}[self.backend])
         return data
         
     def _extract_predictions(self, data):
-        """Return <data> with the predicted labels and probabilities added"""
+        """Return <data> with the predicted labels and probabilities added.
+        The model is only run on the unique sentences that are not in
+        self.predictions yet."""
         sentences = data['Sentence'].values.tolist()
-        preds_h_or_s = self.classifier.predict(sentences)
-        predicted_labels = [x[0].replace('__label__','') for x in preds_h_or_s[0]]
-        predicted_probs = [x[0] for x in preds_h_or_s[1]]
+        new_sentences = [x for x in dict.fromkeys(sentences) if x not in self.predictions]
+        for batch_start in range(0, len(new_sentences), PREDICTION_BATCH_SIZE):
+            batch = new_sentences[batch_start:batch_start+PREDICTION_BATCH_SIZE]
+            preds_h_or_s = self.classifier.predict(batch)
+            for sentence, labels, probs in zip(batch, preds_h_or_s[0], preds_h_or_s[1]):
+                self.predictions[sentence] = (labels[0].replace('__label__',''), probs[0])
+            self.unsaved_predictions = True
+        predicted_labels = np.array([self.predictions[x][0] for x in sentences], dtype='object')
+        predicted_probs = np.array([self.predictions[x][1] for x in sentences], dtype='float')
+        assert np.isin(predicted_labels, ['s','h']).all()
         
         #Now flip the predicted probs for the healthy because we want to
         #output the probability that the sentence is sick.
         #Also binarize the predicted labels to 1 and 0 from s and h
-        predicted_labels_final = []
-        predicted_probs_final = []
-        for index in range(len(sentences)):
-            if predicted_labels[index] == 's':
-                predicted_labels_final.append(1)
-                predicted_probs_final.append(predicted_probs[index])
-            elif predicted_labels[index] == 'h':
-                predicted_labels_final.append(0)
-                #one minus, because we want this to report the probability of being
-                #sick (which is the opposite of the probability of being healthy)
-                predicted_probs_final.append(1 - predicted_probs[index])
-            else:
-                assert False
-        data['PredLabel'] = predicted_labels_final
-        data['PredProb'] = predicted_probs_final
+        sick = (predicted_labels == 's')
+        data['PredLabel'] = sick.astype('int').tolist()
+        #one minus for healthy, because we want this to report the probability
+        #of being sick (which is the opposite of the probability of being healthy)
+        data['PredProb'] = np.where(sick, predicted_probs, 1 - predicted_probs).tolist()
         return data
     
+    # Prediction Cache #--------------------------------------------------------
+    def _load_prediction_cache(self):
+        """Load the cached predictions of the model into self.predictions, a
+        dictionary where the keys are sentences and the values are tuples of
+        (label, probability) as output by the model"""
+        self.predictions = {}
+        self.unsaved_predictions = False
+        if self.prediction_cache_dir is not None:
+            cache_path = self._prediction_cache_path()
+            if os.path.isfile(cache_path):
+                self.predictions = pickle.load(open(cache_path, 'rb'))
+    
+    def _save_prediction_cache(self):
+        if (self.prediction_cache_dir is None) or (not self.unsaved_predictions):
+            return
+        cache_files.save_pickle_atomically(self.predictions, self._prediction_cache_path())
+        self.unsaved_predictions = False
+    
+    def _prediction_cache_path(self):
+        prefix = {'fasttext':'Fasttext','hashing':'Hashing'}[self.backend]
+        return os.path.join(self.prediction_cache_dir, prefix+'Predictions_'+self.model_hash+'.pkl')
+    
     def _clean_up(self):
         if not self.save_model_files:
-            os.remove(os.path.join(self.results_dir,'skipgram_model.bin'))
+            for filename in ['skipgram_model.bin','skipgram_vectors.vec']:
+                if os.path.isfile(os.path.join(self.results_dir,filename)):
+                    os.remove(os.path.join(self.results_dir,filename))
             os.remove(os.path.join(self.results_dir,'classifier.bin'))
             os.remove(os.path.join(self.results_dir,'fasttext_train_set.txt'))
             os.remove(os.path.join(self.results_dir,'fasttext_test_set.txt'))                  
-    
\ No newline at end of file
+    
+
+
+def hash_file(path):
+    """Return a sha1 hash of the contents of the file <path>"""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1<<20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def fingerprint_training(data_hash, model_params, configuration):
+    """Return a sha1 hash that identifies a trained classifier: <data_hash> is
+    a hash of the training sentences and labels (e.g. the hash_file() of the
+    Fasttext training file), <model_params> are the hyperparameters, and
+    <configuration> is anything else that changes the model"""
+    fingerprint = [data_hash, sorted(model_params.items()), configuration]
+    return hashlib.sha1(repr(fingerprint).encode('utf-8')).hexdigest()
+
+
+def hash_sentences(sentences, labels):
+    """Return a sha1 hash of the lists <sentences> and <labels>"""
+    sha1 = hashlib.sha1()
+    for sentence, label in zip(sentences, labels):
+        sha1.update((label+'\t'+sentence+'\n').encode('utf-8'))
+    return sha1.hexdigest()
+
+
+def save_word_vectors(model, vectors_path):
+    """Save the word vectors of the Fasttext <model> to <vectors_path> in the
+    .vec text format that the pretrainedVectors option expects"""
+    words = model.get_words()
+    with open(vectors_path, 'w') as f:
+        f.write(str(len(words))+' '+str(model.get_dimension())+'\n')
+        for word in words:
+            vector = model.get_word_vector(word)
+            f.write(word+' '+' '.join([str(x) for x in vector.tolist()])+'\n')
@@ -21,8 +21,11 @@
 #OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 #SOFTWARE
 
+import concurrent.futures
+import numpy as np
+
 from src import evaluation
-from src.rules import rules_ct, rules_cxr
+from src.rules import rules_ct, rules_cxr, compiled_rules
 
 ##############################
 # Class to Run Rules on Data #--------------------------------------------------
@@ -30,26 +33,37 @@ from src.rules import rules_ct, rules_cxr
 class ApplyRules(object):
     """Apply a rule-based method to extract 'sick' parts of radiology report
     sentences"""
-    def __init__(self, data, setname, rules_to_use):
+    def __init__(self, data, setname, rules_to_use, cache_dir=None, workers=1,
+                 runtime='string'):
         """Variables:
         <data>: dataset, as described in demo.py and run_sarle.py
         <setname>: either 'train' or 'test' or 'predict'
         <rules_to_use>: either 'duke_ct_rules', 'cxr_amb_pos_rules', or
             'cxr_amb_neg_rules'
+        <cache_dir>: optional path to a directory in which the rule output
+            for each unique sentence is cached across runs. The cache is
+            specific to the rule set, and is not used anymore once the
+            rules or the rule functions change. The cached outputs are also
+            kept in memory, which costs memory per unique sentence. Without
+            a <cache_dir> nothing is kept after the rules are applied.
+        <workers>: int, number of processes used to apply the rules. If more
+            than 1, the unique sentences that are not cached yet are split
+            into <workers> chunks that are processed in parallel. The output
+            is the same either way.
+        <runtime>: either 'string', 'token', or 'column', the implementation
+            of the rule functions to use (see compiled_rules.CompiledRules). The output
+            is the same either way.
         """
         self.data = data
         self.setname = setname
         assert self.setname in ['train','test','predict']
                 
-        if rules_to_use=='duke_ct_rules':
-            self.rules_order = rules_ct.RULES_ORDER_CT
-            self.rules_def = rules_ct.RULES_DEF_CT
-        elif rules_to_use=='cxr_amb_pos_rules':
-            self.rules_order = rules_cxr.RULES_ORDER_CXR_AMBPOS
-            self.rules_def = rules_cxr.RULES_DEF_CXR_AMBPOS
-        elif rules_to_use=='cxr_amb_neg_rules':
-            self.rules_order = rules_cxr.RULES_ORDER_CXR_AMBNEG
-            self.rules_def = rules_cxr.RULES_DEF_CXR_AMBNEG
+        self.rules_to_use = rules_to_use
+        self.rules_order, self.rules_def = return_rules(rules_to_use)
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.runtime = runtime
+        self.compiled_rules = compiled_rules.load_compiled_rules(self.rules_order, self.rules_def, cache_dir, runtime)
     
         #Run rules to separate healthy and sick phrases.
         if not self.data.empty:
@@ -62,17 +76,35 @@ class ApplyRules(object):
         self.data = self.data.rename(columns={'Sentence':'OriginalSentence'})
         #pad with spaces. important to ensure terms at beginning of words work
         self.data['OriginalSentence'] = [' '+x+' ' for x in self.data['OriginalSentence'].values.tolist()]
-        self.data['Sentence']=self.data['OriginalSentence'].values.tolist() #will contain modified version of sentence acceptable for term search
-        self.data['PredLabelConservative']=1 #assume sick unless marked healthy
-        for idx in self.data.index.values.tolist():
-            sent = self.data.at[idx,'OriginalSentence']
-            for mainword in self.rules_order:
-                func = self.rules_def[mainword]['function']
-                kwargs = self.rules_def[mainword]
-                modified, sent = func(sentence=sent,mainword=mainword,**kwargs)
-                if modified:
-                    self.data.at[idx,'PredLabelConservative']=0
-                    self.data.at[idx,'Sentence'] = sent
+        #The rules are run only once for each unique sentence, since the same
+        #sentences (e.g. 'the lungs are clear') are repeated in many reports.
+        #Only the rules whose mainwords are in the sentence are run.
+        unique_sentences = self.data['OriginalSentence'].unique().tolist()
+        apply_many = self._apply_rules_in_parallel if self.workers > 1 else None
+        results = self.compiled_rules.apply_unique(unique_sentences,
+                        remember=(self.cache_dir is not None), apply_many=apply_many)
+        if self.cache_dir is not None:
+            self.compiled_rules.save_cache(self.cache_dir)
+        outputs = [results[sent] for sent in self.data['OriginalSentence'].values.tolist()]
+        #Sentence will contain modified version of sentence acceptable for term
+        #search (the original sentence if no rule modified it)
+        self.data['Sentence'] = [sent for modified, sent in outputs]
+        #assume sick unless marked healthy
+        self.data['PredLabelConservative'] = [0 if modified else 1 for modified, sent in outputs]
+    
+    def _apply_rules_in_parallel(self, new_sentences):
+        """Return a list of the outputs of the rules for each sentence in the
+        list <new_sentences>, computed in self.workers processes"""
+        if len(new_sentences) <= 1:
+            return self.compiled_rules.apply_many(new_sentences)
+        #The workers get the name of the rule set rather than the rule
+        #functions, and compile the rules themselves
+        chunks = [x.tolist() for x in np.array_split(np.array(new_sentences, dtype='object'), self.workers) if len(x) > 0]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers,
+                initializer=initialize_rules_worker,
+                initargs=(self.rules_to_use, self.runtime)) as executor:
+            chunk_outputs = list(executor.map(rules_worker, chunks))
+        return [x for chunk_output in chunk_outputs for x in chunk_output]
     
     def _extract_predictions(self):
         """Report overall performance and put binary labels, predicted
@@ -82,16 +114,13 @@ class ApplyRules(object):
         #the empty string so that we can produce our labels based on assuming
         #that a healthy sentence is the empty string.
         #Note that ' '.join(' '.split()) produces the empty string.
-        self.data['Sentence'] = [' '.join(x.split()) for x in self.data['Sentence'].values.tolist()]
+        self.data['Sentence'] = self.data['Sentence'].str.split().str.join(' ')
         
         #Actual PredLabel should be healthy only if there is NOTHING left in the
         #Sentence column because then it means every component of the sentence
         #was deemed healthy. If any part is remaining, that part should be
         #treated as sick. 
-        self.data['PredLabel'] = 1
-        for idx in self.data.index.values.tolist():
-            if self.data.at[idx,'Sentence']=='':
-                self.data.at[idx,'PredLabel'] = 0
+        self.data['PredLabel'] = (self.data['Sentence'] != '').astype('int')
         
         #Rules are not probabilistic so the PredProb column is equal to the
         #PredLabel column. PredProb column is accessed in the eval functions.
@@ -105,4 +134,34 @@ class ApplyRules(object):
             evaluation.report_sentence_level_eval(self.data, self.setname, 'Rules')
         except:
             pass
-                
\ No newline at end of file
+                
+
+
+def return_rules(rules_to_use):
+    """Return the rules order and the rules definition for <rules_to_use>,
+    which is 'duke_ct_rules', 'cxr_amb_pos_rules', or 'cxr_amb_neg_rules'"""
+    if rules_to_use=='duke_ct_rules':
+        return rules_ct.RULES_ORDER_CT, rules_ct.RULES_DEF_CT
+    elif rules_to_use=='cxr_amb_pos_rules':
+        return rules_cxr.RULES_ORDER_CXR_AMBPOS, rules_cxr.RULES_DEF_CXR_AMBPOS
+    elif rules_to_use=='cxr_amb_neg_rules':
+        return rules_cxr.RULES_ORDER_CXR_AMBNEG, rules_cxr.RULES_DEF_CXR_AMBNEG
+    assert False, 'Invalid rules_to_use: '+str(rules_to_use)
+
+##########################
+# Parallel Rule Handling #------------------------------------------------------
+##########################
+#CompiledRules used by each worker process of a parallel ApplyRules. It is
+#created once per worker by initialize_rules_worker() so that the rules are
+#only compiled once per process, not once per chunk.
+WORKER_RULES = None
+
+def initialize_rules_worker(rules_to_use, runtime):
+    global WORKER_RULES
+    rules_order, rules_def = return_rules(rules_to_use)
+    WORKER_RULES = compiled_rules.load_compiled_rules(rules_order, rules_def, runtime=runtime)
+
+def rules_worker(sentences):
+    """Return a list of the outputs of CompiledRules.apply() for each sentence
+    in the list <sentences>"""
+    return WORKER_RULES.apply_many(sentences)
@@ -22,20 +22,24 @@
 #SOFTWARE
 
 import os
-import copy
+import sys
 import pickle
+import hashlib
+import inspect
+import concurrent.futures
 import pandas as pd
 import numpy as np
 
-from src import load, evaluation
-from src.vocab import vocabulary_ct, vocabulary_cxr, gr1cm
+from src import load, evaluation, label_store
+from src.vocab import vocabulary_ct, vocabulary_cxr, gr1cm, compiled_vocabulary
 
 ###################################
 # Determine the note-level labels #---------------------------------------------
 ###################################
 class RadLabel(object):
     def __init__(self, data, setname, dataset_descriptor, results_dir, 
-                 run_locdis_checks, save_output_files=True):
+                 run_locdis_checks, save_output_files=True, workers=1,
+                 previous_term_search_dir=None, vocabulary_cache_dir=None):
         """Output for all methods: performance metrics files
         reporting label frequency, and performance of the different methods.
         
@@ -63,7 +67,19 @@ class RadLabel(object):
             sanity checks to correct the output.
         <save_output_files> is True by default to ensure all output files
             are saved. It is only set to False within unit tests to avoid
-            saving output files during unit testing."""
+            saving output files during unit testing.
+        <workers>: int, number of processes used for the term search. If
+            more than 1, the reports are split into <workers> shards that are
+            labeled in parallel. The output is the same either way.
+        <previous_term_search_dir>: optional path to the term search results
+            directory of a previous run on the same set. If provided, only
+            reports that are new or whose sentences have changed since that
+            run are labeled, and the labels of all other reports are copied
+            from the previous run's BinaryLabels. If the vocabulary or
+            <run_locdis_checks> changed, every report is labeled again.
+        <vocabulary_cache_dir>: optional path to a directory in which the
+            compiled vocabulary is cached between runs (see
+            src/vocab/compiled_vocabulary.py)"""
         self.dataset_descriptor = dataset_descriptor
         
         if self.dataset_descriptor == 'openi_cxr':
@@ -86,6 +102,9 @@ class RadLabel(object):
         self.wrong_vessel_values = 0
         
         self.save_output_files = save_output_files
+        self.workers = workers
+        self.previous_term_search_dir = previous_term_search_dir
+        self.vocabulary_cache_dir = vocabulary_cache_dir
 
         #Run
         if not self.data.empty:
@@ -159,19 +178,11 @@ class RadLabel(object):
         """Return a dataframe with index of filenames (from self.uniq_set_files)
         and columns of <chosen_labels>. This is the old-fashioned output format.
         <label_type> is the type of the chosen_labels. It is either 'disease'
-        (to access rows) or 'location' (to access columns)"""
+        (to access rows) or 'location' (to access columns).
+        The reduction over self.out_bin is cached so repeated calls are cheap."""
         assert label_type in ['disease','location']
-        binarized = pd.DataFrame(np.zeros((len(self.uniq_set_files),len(chosen_labels))),
-                        index = self.uniq_set_files, columns = chosen_labels)
-        for filename in self.uniq_set_files:
-            for label in chosen_labels:
-                if label_type == 'location':
-                    value = np.sum(self.out_bin[filename].loc[:,label])
-                elif label_type == 'disease':
-                    value = np.sum(self.out_bin[filename].loc[label,:])
-                if value > 0:
-                    value = 1
-                binarized.at[filename, label] = value
+        binarized = self.out_bin.binarize(chosen_labels, label_type)
+        assert binarized.index.values.tolist() == self.uniq_set_files
         return binarized
     
     #############################
@@ -179,209 +190,210 @@ class RadLabel(object):
     #############################
     def obtain_sarle_complex_labels(self): #Done with testing
         """Generate location and disease labels
-        Produces self.out_bin which is a dictionary where the keys are filenames
-        (report IDs), and the values are binary pandas dataframes (since I don't
-        think counts make sense in this context.) A single pandas dataframe is
-        organized with disease as rows and locations as columns."""
-        self.out_bin = {}
-        if self.setname == 'train':            
-            other_disease = open(os.path.join(self.results_dir,'train_other_disease_sentences.txt'),'a')
-            other_location = open(os.path.join(self.results_dir,'train_other_location_sentences.txt'),'a')
-
-        #Fill self.out with dataframes of predicted labels:
-        for filename in self.uniq_set_files:
-            #selected_out is for this filename only:
-            selected_out = pd.DataFrame(np.zeros((len(list(self.mega_disease_dict.keys()))+1,
-                                              len(list(self.mega_loc_dict.keys()))+1)),
-                           columns = list(self.mega_loc_dict.keys())+['other_location'],
-                           index = list(self.mega_disease_dict.keys())+['other_disease'])     
-            selected_sickdf = self.sickdf[self.sickdf['Filename']==filename]
-            for sentence in selected_sickdf['Sentence'].values.tolist():
-                #the temp dfs, index is keyterms and column is 'SentenceValue'
-                temp_location = self.return_temp_for_location_search(sentence)
-                temp_disease = self.return_temp_for_disease_search(sentence)
-                
-                #iterate through locations first
-                for location in temp_location.index.values.tolist():
-                    if temp_location.at[location,'SentenceValue'] > 0:
-                        #once you know the location, figure out the disease
-                        location_recorded = False
-                        for disease in temp_disease.index.values.tolist():
-                            if temp_disease.at[disease,'SentenceValue'] > 0 :
-                                selected_out.at[disease, location] = 1
-                                location_recorded = True
-                        if not location_recorded:
-                            #makes sure every location gets recorded
-                            selected_out.at['other_disease', location] = 1
-                            if self.setname == 'train':
-                                other_disease.write(location+'\t'+sentence+'\n')
-                
-                #iterate through disease second and make sure none were missed
-                for disease in temp_disease.index.values.tolist():
-                    if temp_disease.at[disease,'SentenceValue'] > 0:
-                        if np.sum(selected_out.loc[disease,:].values) == 0:
-                            #i.e. if we haven't recorded that disease yet,
-                            selected_out.at[disease,'other_location'] = 1
-                            if self.setname == 'train':
-                                other_location.write(disease+'\t'+sentence+'\n')
-            #Clean up
-            if self.run_locdis_checks:
-                selected_out = self.clean_up_forbidden_values(selected_out)
-            #Save the labels for this patient (filename):
-            self.out_bin[filename] = selected_out
-        #The end
-        self.report_corrected_forbidden_values()
-    
-    # Clean up based on forbidden values #--------------------------------------
-    def clean_up_forbidden_values(self, selected_out):
-        """Delete 'impossible' location-disease combinations ('impossible'
-        according to medical knowledge, e.g. you cannot have an enlarged heart
-        'in the lungs.')"""
-        #Iterate throuh 
-        for lung_disease in list(self.lung_disease_dict.keys()):
-            for non_lung_loc in (list(self.heart_loc_dict.keys())+list(self.generic_loc_dict.keys())):
-                if selected_out.at[lung_disease, non_lung_loc] == 1:
-                    self.wrong_lung_values+=1
-                    selected_out.at[lung_disease, non_lung_loc] = 0
-        for heart_disease in list(self.heart_disease_dict.keys()):
-            for non_heart_loc in (list(self.lung_loc_dict.keys())+list(self.generic_loc_dict.keys())):
-                if selected_out.at[heart_disease, non_heart_loc] == 1:
-                    self.wrong_heart_values+=1
-                    selected_out.at[heart_disease, non_heart_loc] = 0
+        Produces self.out_bin which is a label_store.BinaryLabels object
+        holding one binary array (since I don't think counts make sense in
+        this context) of shape reports x diseases x locations. self.out_bin
+        can still be used like a dictionary where the keys are filenames
+        (report IDs), and the values are pandas dataframes organized with
+        disease as rows and locations as columns."""
+        sick_sentences = RadLabel.group_sentences_by_filename(self.sickdf)
         
-        #Now iterate through locations for prespecified 'forbidden diseases':
-        selected_out, vessel_count = RadLabel.clean_forbidden_helper(self.vessel_loc_dict, self.vocabmodule.return_forbidden('great_vessel'), selected_out)
-        self.wrong_vessel_values+=vessel_count
+        #In incremental mode, reuse the labels of reports that have not
+        #changed since the previous run
+        self.report_hashes = {f:RadLabel.hash_report(sick_sentences.get(f, [])) for f in self.uniq_set_files}
+        self.vocabulary_fingerprint = self.return_vocabulary_fingerprint()
+        previous_bin = self.load_previous_labels()
+        to_label = [f for f in self.uniq_set_files if f not in previous_bin]
+        if self.previous_term_search_dir is not None:
+            print('Reusing labels for',len(previous_bin),'reports and labeling',len(to_label),'new or changed reports')
         
-        selected_out, heart_count = RadLabel.clean_forbidden_helper(self.heart_loc_dict, self.vocabmodule.return_forbidden('heart'), selected_out)
-        self.wrong_heart_values+=heart_count
+        new_bin, other_disease_lines, other_location_lines = self.label_all_reports(to_label, sick_sentences)
         
-        selected_out, lung_count = RadLabel.clean_forbidden_helper(self.lung_loc_dict, self.vocabmodule.return_forbidden('lung'), selected_out)
-        self.wrong_lung_values+=lung_count
-        return selected_out
+        if self.setname == 'train':
+            with open(os.path.join(self.results_dir,'train_other_disease_sentences.txt'),'a') as other_disease:
+                other_disease.writelines(other_disease_lines)
+            with open(os.path.join(self.results_dir,'train_other_location_sentences.txt'),'a') as other_location:
+                other_location.writelines(other_location_lines)
+        
+        #Clean up (reused labels were already cleaned up in the previous run)
+        if self.run_locdis_checks:
+            self.clean_up_forbidden_values(new_bin)
+        
+        #Put reused and new labels together in the order of self.uniq_set_files
+        if len(previous_bin) > 0:
+            self.out_bin = label_store.BinaryLabels.concat([previous_bin, new_bin]).select(self.uniq_set_files)
+        else:
+            self.out_bin = new_bin
+        #The end
+        self.report_corrected_forbidden_values()
     
-    @staticmethod
-    def clean_forbidden_helper(loc_dict, forbidden_disease, selected_out):
-        """Return <selected_out> modified so that diseases in <forbidden_disease>
-        is removed from locations in <loc_dict>. Also return a count of the
-        number of mistakes fixed."""
-        count = 0 
-        for loc in list(loc_dict.keys()):
-            for disease in forbidden_disease:
-                if selected_out.at[disease, loc] == 1:
-                    count+=1
-                    selected_out.at[disease, loc] = 0
-        return selected_out, count
+    def label_all_reports(self, filenames, sick_sentences):
+        """Return the output of label_reports() for <filenames>, running the
+        term search in self.workers processes if self.workers > 1"""
+        if self.workers > 1 and len(filenames) > 1:
+            #Label contiguous shards of the sorted filenames in parallel and
+            #put them back together in order
+            shards = [x.tolist() for x in np.array_split(np.array(filenames, dtype='object'), self.workers) if len(x) > 0]
+            shard_inputs = [(shard, {f:sick_sentences[f] for f in shard if f in sick_sentences}) for shard in shards]
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers,
+                    initializer=initialize_term_search_worker,
+                    initargs=(self.dataset_descriptor, self.vocabulary_cache_dir)) as executor:
+                shard_outputs = list(executor.map(term_search_worker, shard_inputs))
+            out_bin = label_store.BinaryLabels.concat([x[0] for x in shard_outputs])
+            other_disease_lines = [line for x in shard_outputs for line in x[1]]
+            other_location_lines = [line for x in shard_outputs for line in x[2]]
+            return out_bin, other_disease_lines, other_location_lines
+        return self.label_reports(filenames, sick_sentences)
     
-    # Report total values for this set #----------------------------------------
-    def report_corrected_forbidden_values(self):
-        """Calculate how many individual labels are being produced for this set"""
-        total_values = len(self.mega_disease_dict.keys())*len(self.mega_loc_dict.keys())*len(self.uniq_set_files)
-        print(self.setname,'total values:',total_values)
-        print('\tmega_disease_dict.keys():',len(self.mega_disease_dict.keys()))
-        print('\tmega_loc_dict.keys():',len(self.mega_loc_dict.keys()))
-        print('\tlen(uniq_set_files):',len(self.uniq_set_files))
-        print('\ttotal:',total_values)
-        print('wrong_lung_values (corrected):',self.wrong_lung_values,',',round(100*self.wrong_lung_values/total_values,2),'%')
-        print('wrong_heart_values (corrected):',self.wrong_heart_values,',',round(100*self.wrong_heart_values/total_values,2),'%')
-        print('wrong_vessel_values (corrected):',self.wrong_vessel_values,',',round(100*self.wrong_vessel_values/total_values,2),'%')
+    def label_reports(self, filenames, sick_sentences):
+        """Return a label_store.BinaryLabels object with the location x
+        disease labels of the reports in <filenames>, as well as the lists of
+        lines for the train_other_disease_sentences.txt and
+        train_other_location_sentences.txt files.
+        <sick_sentences> is a dictionary where the keys are filenames and the
+            values are lists of the sick sentences of that report."""
+        out_bin = label_store.BinaryLabels(filenames, self.vocabulary.diseases,
+                                           self.vocabulary.locations)
+        locations_all = self.vocabulary.locations
+        diseases_all = self.vocabulary.diseases
+        other_disease = self.vocabulary.disease_index['other_disease']
+        other_location = self.vocabulary.location_index['other_location']
+        other_disease_lines = []
+        other_location_lines = []
         
-    # Initialize term dictionaries #--------------------------------------------
-    def initialize_vocabulary_dicts(self):
-        #Load dictionaries from self.vocabmodule.py
-        self.lung_loc_dict, self.lung_disease_dict = self.vocabmodule.return_lung_terms()
-        self.heart_loc_dict, self.heart_disease_dict = self.vocabmodule.return_heart_terms()
-        self.vessel_loc_dict = self.vocabmodule.return_great_vessel_terms()
-        self.generic_loc_dict, self.generic_disease_dict = self.vocabmodule.return_generic_terms()
-        
-        #Make super dicts:
-        self.mega_loc_dict = self.aggregate_dicts([self.lung_loc_dict,
-                        self.heart_loc_dict, self.vessel_loc_dict,self.generic_loc_dict])
-        self.mega_disease_dict = self.aggregate_dicts([self.lung_disease_dict,
-                        self.heart_disease_dict, self.generic_disease_dict])
+        #Run the term search only once for each unique sick sentence, since
+        #the same sentences are repeated across many reports
+        sentence_labels = self.term_search_unique_sentences(
+            [sentence for filename in filenames for sentence in sick_sentences.get(filename, [])])
         
-    def aggregate_dicts(self, dicts):
-        super_dict = {}
-        keylens = 0
-        for d in dicts:
-            keylens+=len(list(d.keys()))
-            for k, v in d.items():
-                super_dict[k] = v
-        assert len(list(super_dict.keys())) == keylens
-        return super_dict
+        #Fill out_bin with the predicted labels:
+        for filename in filenames:
+            #selected_out is for this filename only (a view into out_bin):
+            selected_out = out_bin.array[out_bin.filename_index[filename]]
+            for sentence in sick_sentences.get(filename, []):
+                locations, diseases = sentence_labels[sentence]
+                
+                #every disease is in every location of the sentence
+                selected_out[np.ix_(diseases, locations)] = 1
+                if len(diseases)==0:
+                    #makes sure every location gets recorded
+                    selected_out[other_disease, locations] = 1
+                    other_disease_lines.extend([locations_all[location]+'\t'+sentence+'\n' for location in locations])
+                
+                #make sure no disease was missed
+                if len(diseases) > 0:
+                    missed = diseases[~selected_out[diseases,:].any(axis=1)]
+                    #i.e. if we haven't recorded that disease yet,
+                    selected_out[missed, other_location] = 1
+                    other_location_lines.extend([diseases_all[disease]+'\t'+sentence+'\n' for disease in missed])
+        return out_bin, other_disease_lines, other_location_lines
     
-    # Location Helper Functions #----------------------------------------------
-    def return_temp_for_location_search(self, sentence):
-        """Return a dataframe called <temp> which reports the results of
-        the location term search using rules defined by <loc_dict> and
-        <disease_dict>, for the string <sentence>
-        <body_region> is 'lung' or 'heart' or 'other.' Determines how/whether
-            the disease_dict will be used here"""
-        #temp is a dataframe for this particular sentence ONLY
-        temp = pd.DataFrame(np.zeros((len(list(self.mega_loc_dict.keys())),1)),
-                                        index = list(self.mega_loc_dict.keys()),
-                                        columns = ['SentenceValue'])
-        
-        #look for location phrases
-        for locterm in self.mega_loc_dict.keys():
-            locterm_present = RadLabel.label_for_keyterm_and_sentence(locterm, sentence, self.mega_loc_dict)
-            if locterm_present: #update out dataframe for specific lung location
-                temp.at[locterm,'SentenceValue'] = 1
+    def term_search_unique_sentences(self, sentences):
+        """Return a dictionary where the keys are the unique sentences of
+        <sentences> and the values are the outputs of self.search_sentence()
+        for that sentence."""
+        unique_sentences = list(dict.fromkeys(sentences))
+        print('Term search on',len(unique_sentences),'unique sentences out of',len(sentences),'sick sentences')
+        return {sentence:self.search_sentence(sentence) for sentence in unique_sentences}
+    
+    def search_sentence(self, sentence):
+        """Return a tuple of (locations, diseases): integer arrays of the ids
+        of the locations and diseases found in <sentence>, in the order of
+        self.vocabulary.locations and self.vocabulary.diseases"""
+        vocabulary = self.vocabulary
+        location_index = vocabulary.location_index
+        #find all the vocabulary terms in the sentence in one pass
+        hits = self.term_matcher.find_hits(sentence)
+        #decide every location keyterm and every disease keyterm once
+        location_hits = np.zeros(len(vocabulary.locations), dtype='bool')
+        location_hits[0:len(self.mega_loc_dict)] = self.term_matcher.label_vector('location', hits)
+        disease_hits = np.zeros(len(vocabulary.diseases), dtype='bool')
+        disease_hits[0:len(self.mega_disease_dict)] = self.term_matcher.label_vector('disease', hits)
         
         #use location-specific diseases
         #Look for lung-specific diseases with right vs left
-        right, left, lung = RadLabel.label_for_right_and_left_from_diseases(sentence, self.lung_disease_dict)
-        if lung:
-            temp.at['lung','SentenceValue'] = 1
-        if right:
-            temp.at['right_lung','SentenceValue'] = 1
-        if left:
-            temp.at['left_lung','SentenceValue'] = 1
+        if disease_hits[vocabulary.lung_disease_ids].any():
+            location_hits[location_index['lung']] = True
+            if 'right' in sentence:
+                location_hits[location_index['right_lung']] = True
+            if ('left' in sentence) or ('lingula' in sentence):
+                location_hits[location_index['left_lung']] = True
         
         #Lung detailed--> general. If you have already decided something is in
         #the right_mid lobe, then right_lung and lung should be positive too.
         #(We need this step because the previous step using 'lung-specific
         #diseases with right vs left' applies ONLY to lung-specific diseases
         #and here we need to address generic diseases e.g. nodules.
-        for right_lobe in ['right_upper','right_mid','right_lower']:
-            if temp.at[right_lobe,'SentenceValue'] == 1:
-                temp.at['right_lung','SentenceValue'] = 1
-                temp.at['lung','SentenceValue'] = 1
-        for left_lobe in ['left_upper','left_mid','left_lower']:
-            if temp.at[left_lobe,'SentenceValue'] == 1:
-                temp.at['left_lung','SentenceValue'] = 1
-                temp.at['lung','SentenceValue'] = 1
+        for side_lung, lobes in vocabulary.lobe_rollup_ids.items():
+            if location_hits[lobes].any():
+                location_hits[side_lung] = True
+                location_hits[location_index['lung']] = True
         
         #Look for heart-specific diseases
-        for diseaseterm in self.heart_disease_dict.keys():
-            diseaseterm_present = RadLabel.label_for_keyterm_and_sentence(diseaseterm, sentence, self.heart_disease_dict)
-            if diseaseterm_present:
-                temp.at['heart','SentenceValue'] = 1
-        return temp
-    
-    # Disease Helper Functions #------------------------------------------------
-    def return_temp_for_disease_search(self, sentence):
-        """Return a dataframe called <temp> which reports the results of
-        the disease term search defined by <disease_dict> for the string <sentence>"""
-        #temp is a dataframe for this particular sentence ONLY
-        temp = pd.DataFrame(np.zeros((len(list(self.mega_disease_dict.keys())),1)),
-                                        index = list(self.mega_disease_dict.keys()),
-                                        columns = ['SentenceValue'])
-        #Look for disease phrases
-        for diseaseterm in self.mega_disease_dict.keys():
-            diseaseterm_present = RadLabel.label_for_keyterm_and_sentence(diseaseterm, sentence, self.mega_disease_dict)
-            if diseaseterm_present: #update out dataframe for specific lung location
-                temp.at[diseaseterm,'SentenceValue'] = 1
+        if disease_hits[vocabulary.heart_disease_ids].any():
+            location_hits[location_index['heart']] = True
         
         #Special lymphadenopathy and nodulegr1cm handling that uses measurements
         if 'lymphadenopathy' in self.mega_disease_dict.keys():
             if gr1cm.lymphadenopathy_handling(sentence) == 1:
-                temp.at['lymphadenopathy','SentenceValue'] = 1
+                disease_hits[vocabulary.disease_index['lymphadenopathy']] = True
         if 'nodulegr1cm' in self.mega_disease_dict.keys():
             if gr1cm.nodulegr1cm_handling(sentence) == 1:
-                temp.at['nodulegr1cm','SentenceValue'] = 1
+                disease_hits[vocabulary.disease_index['nodulegr1cm']] = True
         
-        return temp
+        return np.flatnonzero(location_hits), np.flatnonzero(disease_hits)
+    
+    # Clean up based on forbidden values #--------------------------------------
+    def clean_up_forbidden_values(self, out_bin):
+        """Delete 'impossible' location-disease combinations ('impossible'
+        according to medical knowledge, e.g. you cannot have an enlarged heart
+        'in the lungs.') from all the reports in <out_bin> at once, and
+        count the number of mistakes fixed for each body system."""
+        assert out_bin.diseases == self.vocabulary.diseases
+        assert out_bin.locations == self.vocabulary.locations
+        out = out_bin.array
+        for system, mask in self.vocabulary.forbidden_masks.items():
+            count = int(out[:,mask].sum())
+            out[:,mask] = 0
+            if system == 'lung':
+                self.wrong_lung_values+=count
+            elif system == 'heart':
+                self.wrong_heart_values+=count
+            elif system == 'great_vessel':
+                self.wrong_vessel_values+=count
+        out_bin.clear_cache()
+    
+    # Report total values for this set #----------------------------------------
+    def report_corrected_forbidden_values(self):
+        """Calculate how many individual labels are being produced for this set"""
+        total_values = len(self.mega_disease_dict.keys())*len(self.mega_loc_dict.keys())*len(self.uniq_set_files)
+        print(self.setname,'total values:',total_values)
+        print('\tmega_disease_dict.keys():',len(self.mega_disease_dict.keys()))
+        print('\tmega_loc_dict.keys():',len(self.mega_loc_dict.keys()))
+        print('\tlen(uniq_set_files):',len(self.uniq_set_files))
+        print('\ttotal:',total_values)
+        print('wrong_lung_values (corrected):',self.wrong_lung_values,',',round(100*self.wrong_lung_values/total_values,2),'%')
+        print('wrong_heart_values (corrected):',self.wrong_heart_values,',',round(100*self.wrong_heart_values/total_values,2),'%')
+        print('wrong_vessel_values (corrected):',self.wrong_vessel_values,',',round(100*self.wrong_vessel_values/total_values,2),'%')
+        
+    # Initialize term dictionaries #--------------------------------------------
+    def initialize_vocabulary_dicts(self):
+        #Load the compiled vocabulary built from self.vocabmodule.py
+        self.vocabulary = compiled_vocabulary.load_compiled_vocabulary(self.vocabmodule, self.vocabulary_cache_dir)
+        self.lung_loc_dict = self.vocabulary.lung_loc_dict
+        self.lung_disease_dict = self.vocabulary.lung_disease_dict
+        self.heart_loc_dict = self.vocabulary.heart_loc_dict
+        self.heart_disease_dict = self.vocabulary.heart_disease_dict
+        self.vessel_loc_dict = self.vocabulary.vessel_loc_dict
+        self.generic_loc_dict = self.vocabulary.generic_loc_dict
+        self.generic_disease_dict = self.vocabulary.generic_disease_dict
+        
+        #Super dicts:
+        self.mega_loc_dict = self.vocabulary.mega_loc_dict
+        self.mega_disease_dict = self.vocabulary.mega_disease_dict
+        
+        #One automaton over every location and disease term:
+        self.term_matcher = self.vocabulary.term_matcher
     
     # Lung Missingness #--------------------------------------------------------
     def obtain_sarle_lung_missingness(self):
@@ -397,33 +409,29 @@ class RadLabel(object):
         #First, get a binary representation of the lung location predictions:
         lung_bin = self.binarize_complex_labels(chosen_labels = list(self.lung_loc_dict.keys()), label_type='location')
         
+        lung = lung_bin['lung'].values == 1
+        right = lung_bin['right_lung'].values == 1
+        left = lung_bin['left_lung'].values == 1
+        right_lobes = lung_bin[self.vocabulary.lobe_rollups['right_lung']].values.any(axis=1)
+        left_lobes = lung_bin[self.vocabulary.lobe_rollups['left_lung']].values.any(axis=1)
+        
         #Initialize and fill in missingness df:
         cols = ['left_lobes_all','right_lobes_all','lungs_right_left']
         missing = pd.DataFrame(np.ones((len(self.uniq_set_files), len(cols))),
                     index = self.uniq_set_files, columns = cols)
-        for filename in missing.index.values.tolist():
-            if ((lung_bin.at[filename,'lung']==1)
-                and (lung_bin.at[filename,'right_lung']==0)
-                and (lung_bin.at[filename,'left_lung']==0)):
-                missing.at[filename,'lungs_right_left'] = 0
-            if ((lung_bin.at[filename,'right_lung']==1)
-                and (lung_bin.at[filename,'right_lower']==0)
-                and (lung_bin.at[filename,'right_upper']==0)
-                and (lung_bin.at[filename,'right_mid']==0)):
-                missing.at[filename,'right_lobes_all'] = 0
-            if ((lung_bin.at[filename,'left_lung']==1)
-                and (lung_bin.at[filename,'left_lower']==0)
-                and (lung_bin.at[filename,'left_upper']==0)
-                and (lung_bin.at[filename,'left_mid']==0)):
-                missing.at[filename,'left_lobes_all'] = 0
+        missing.loc[lung & (~right) & (~left), 'lungs_right_left'] = 0
+        missing.loc[right & (~right_lobes), 'right_lobes_all'] = 0
+        missing.loc[left & (~left_lobes), 'left_lobes_all'] = 0
         self.missing = missing
     
     # General Helper Functions #------------------------------------------------
     def pick_out_sick_sentences(self):
         """Separate sick sentences and healthy sentences and return
         as separate dataframes"""
-        sickdf = copy.deepcopy(self.data)
-        healthydf = copy.deepcopy(self.data)
+        #No copy of self.data is needed here because selecting rows below
+        #(and reset_index) already produces new dataframes
+        sickdf = self.data
+        healthydf = self.data
         if self.dataset_descriptor == 'duke_ct_2019_09_25':
             sets_use_sentence_level_grtruth = ['train']
             sets_use_pred_sentence_labels = ['test','predict']
@@ -459,7 +467,12 @@ class RadLabel(object):
     
     def save_complex_output_files(self):
         """Save output files for location_and_disease
-        out_bin is a dictionary of pandas dataframes and gets pickled"""
+        out_bin is a label_store.BinaryLabels object. It is pickled in the old
+        output format (a dictionary of dataframes, so that the
+        _BinaryLabels.pkl files can still be loaded without this package)
+        and it is also saved in the bit-packed format of
+        label_store.PackedLabels, which training data loaders can
+        memory-map."""
         if self.setname == 'train' or self.setname == 'test':
             self.basic_save()
         
@@ -473,10 +486,10 @@ class RadLabel(object):
                     ids = all_ids[all_ids['Set_Assigned']==description]['Accession'].values.tolist()
                     ids = [x for x in ids if x in available_accs]
                     #Select out_bin filenames and save
-                    out_bin = {}
-                    for key in ids:
-                        out_bin[key] = self.out_bin[key]
-                    pickle.dump(out_bin, open(os.path.join(self.results_dir, description+'_BinaryLabels.pkl'), 'wb'))
+                    out_bin = out_bin.select(ids)
+                    pickle.dump(out_bin.to_dict(), open(os.path.join(self.results_dir, description+'_BinaryLabels.pkl'), 'wb'))
+                    out_bin.save_packed(os.path.join(self.results_dir, description))
+                    self.save_report_hashes(description, ids)
                     #Select disease_out filenames and save
                     disease_out = disease_out.loc[ids,:]
                     disease_out.to_csv(os.path.join(self.results_dir, description+'_DiseaseBinaryLabels.csv'))
@@ -486,8 +499,8 @@ class RadLabel(object):
                     #Select missing filenames and save
                     missing = missing.loc[ids,:]
                     missing.to_csv(os.path.join(self.results_dir, description+'_Missingness.csv'))
-                    return len(list(out_bin.keys())), data.shape[0]
-                outshape = len(list(self.out_bin.keys())); datashape = self.data.shape[0]
+                    return len(out_bin), data.shape[0]
+                outshape = len(self.out_bin); datashape = self.data.shape[0]
                 o1, m1 = save_set('imgtrain_extra', self.out_bin, self.disease_out, self.data, self.missing)
                 o2, m2 = save_set('imgvalid', self.out_bin, self.disease_out, self.data, self.missing)
                 o3, m3 = save_set('imgtest', self.out_bin, self.disease_out, self.data, self.missing)
@@ -495,11 +508,72 @@ class RadLabel(object):
                 assert m1+m2+m3 == datashape
         
     def basic_save(self):
-        pickle.dump(self.out_bin, open(os.path.join(self.results_dir, 'imgtrain_note'+self.setname+'_BinaryLabels.pkl'), 'wb'))
+        pickle.dump(self.out_bin.to_dict(), open(os.path.join(self.results_dir, 'imgtrain_note'+self.setname+'_BinaryLabels.pkl'), 'wb'))
+        self.out_bin.save_packed(os.path.join(self.results_dir, 'imgtrain_note'+self.setname))
+        self.save_report_hashes('imgtrain_note'+self.setname, self.uniq_set_files)
         self.disease_out.to_csv(os.path.join(self.results_dir, 'imgtrain_note'+self.setname+'_DiseaseBinaryLabels.csv'))
         self.data.to_csv(os.path.join(self.results_dir, 'imgtrain_note'+self.setname+'_merged.csv'))
         self.missing.to_csv(os.path.join(self.results_dir, 'imgtrain_note'+self.setname+'_Missingness.csv'))
     
+    ########################
+    # Incremental Labeling #----------------------------------------------------
+    ########################
+    def output_descriptions(self):
+        """Return the list of file prefixes that the output of this set is
+        saved under by save_complex_output_files()"""
+        if ((self.setname == 'predict') and (self.dataset_descriptor in ['duke_ct_2019_09_25','duke_ct_2020_03_17'])):
+            return ['imgtrain_extra','imgvalid','imgtest']
+        return ['imgtrain_note'+self.setname]
+    
+    def return_vocabulary_fingerprint(self):
+        """Return a hash of everything besides the sentences that determines
+        the labels: the vocabulary (including the forbidden pathologies), the
+        code of the term search (this module, gr1cm.py, and the code covered
+        by the compiled vocabulary cache key), and whether the location x
+        disease checks are run"""
+        source = [compiled_vocabulary.return_cache_key(self.vocabmodule), str(self.run_locdis_checks)]
+        source += [inspect.getsource(module) for module in [gr1cm, sys.modules[__name__]]]
+        return hashlib.sha1(repr(source).encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def hash_report(sentences):
+        """Return a hash of the list of sick <sentences> of one report"""
+        return hashlib.sha1('\n'.join(sentences).encode('utf-8')).hexdigest()
+    
+    def save_report_hashes(self, description, filenames):
+        """Save the report hashes of <filenames> and the vocabulary
+        fingerprint so that a later incremental run can reuse these labels"""
+        report_hashes = {'vocabulary_fingerprint':self.vocabulary_fingerprint,
+            'report_hashes':{f:self.report_hashes[f] for f in filenames}}
+        pickle.dump(report_hashes, open(os.path.join(self.results_dir, description+'_ReportHashes.pkl'), 'wb'))
+    
+    def load_previous_labels(self):
+        """Return a label_store.BinaryLabels object with the previous run's
+        labels for every report whose hash has not changed. It is empty if
+        there is no previous run."""
+        previous = []
+        if self.previous_term_search_dir is not None:
+            for description in self.output_descriptions():
+                hashes_path = os.path.join(self.previous_term_search_dir, description+'_ReportHashes.pkl')
+                labels_prefix = os.path.join(self.previous_term_search_dir, description)
+                if not (os.path.isfile(hashes_path) and os.path.isfile(labels_prefix+'_PackedLabels.npy')):
+                    print('No previous labels found for',description,'in',self.previous_term_search_dir)
+                    continue
+                report_hashes = pickle.load(open(hashes_path, 'rb'))
+                if report_hashes['vocabulary_fingerprint'] != self.vocabulary_fingerprint:
+                    print('Vocabulary changed since the previous run: relabeling',description)
+                    continue
+                previous_bin = label_store.PackedLabels(labels_prefix).to_binary_labels()
+                if ((previous_bin.diseases != self.vocabulary.diseases)
+                    or (previous_bin.locations != self.vocabulary.locations)):
+                    continue
+                unchanged = [f for f in previous_bin.keys() if
+                             report_hashes['report_hashes'].get(f) == self.report_hashes.get(f)]
+                previous.append(previous_bin.select(unchanged))
+        if len(previous) > 0:
+            return label_store.BinaryLabels.concat(previous)
+        return label_store.BinaryLabels([], self.vocabulary.diseases, self.vocabulary.locations)
+    
     ##################
     # Model Mistakes #----------------------------------------------------------
     ##################
@@ -508,24 +582,27 @@ class RadLabel(object):
         summary_df = pd.DataFrame(np.empty((5,4),dtype='str'),
                                   columns=['Filename','sarle_Healthy_Sentences',
                                     'sarle_Sick_Sentences','sarle_Mistakes'])
+        #Group the healthy and sick sentences by filename once
+        healthy_sentences = RadLabel.group_sentences_by_filename(self.healthydf)
+        sick_sentences = RadLabel.group_sentences_by_filename(self.sickdf)
         #Fill in the summary_df
         idx=0
         for fname in self.uniq_set_files:
             summary_df.at[idx,'Filename']=fname
             #Get the full text, which is contained in self.merged
-            summary_df.at[idx,'sarle_Healthy_Sentences'] = self.stringify(self.healthydf,fname)
+            summary_df.at[idx,'sarle_Healthy_Sentences'] = self.stringify(healthy_sentences,fname)
             #Get the sick sentences, which is contained in self.sickdf
-            summary_df.at[idx,'sarle_Sick_Sentences'] = self.stringify(self.sickdf,fname)
+            summary_df.at[idx,'sarle_Sick_Sentences'] = self.stringify(sick_sentences,fname)
             #Get the mistakes
             summary_df.at[idx,'sarle_Mistakes'] = self.mistakes_as_string('sarle',fname,self.results_dir)
             idx+=1
         summary_df.to_csv(os.path.join(self.results_dir,'Test_Set_Mistakes_All_Methods.csv'))
     
     # Helper functions for report_test_set_mistakes() #----------------------------
-    def stringify(self, df,filename):
-        """Collapse all the entries of <df> corresponding to <filename>
-        into a single string"""
-        return '. '.join(((df[df['Filename']==filename])['Sentence']).values.tolist())
+    def stringify(self, grouped, filename):
+        """Collapse all the sentences corresponding to <filename> into a
+        single string. <grouped> is the output of group_sentences_by_filename()"""
+        return '. '.join(grouped.get(filename, []))
     
     def mistakes_as_string(self, method_name,filename,results_dir):
         """Format the model's mistakes on report specified by
@@ -546,6 +623,16 @@ class RadLabel(object):
     ##################
     # Static Methods #----------------------------------------------------------
     ##################
+    @staticmethod
+    def group_sentences_by_filename(df):
+        """Return a dictionary where the keys are the filenames in <df> and
+        the values are lists of that filename's sentences, in the order in
+        which they appear in <df>. Lets us look up the sentences of one report
+        without scanning the whole dataframe."""
+        if df.empty:
+            return {}
+        return df.groupby('Filename', sort=False)['Sentence'].apply(list).to_dict()
+    
     @staticmethod
     def label_for_keyterm_and_sentence(keyterm, sentence, termdict):
         """Return label = 1 if <keyterm> in <sentence> else return label = 0"""
@@ -585,6 +672,99 @@ class RadLabel(object):
         return right, left, lung
 
 
+########################
+# Parallel Term Search #--------------------------------------------------------
+########################
+#RadLabel used by each worker process of a parallel term search. It is created
+#once per worker by initialize_term_search_worker() so that the vocabulary is
+#only loaded once per process, not once per shard.
+WORKER_LABELER = None
+
+def initialize_term_search_worker(dataset_descriptor, vocabulary_cache_dir):
+    global WORKER_LABELER
+    WORKER_LABELER = RadLabel(pd.DataFrame(), 'predict', dataset_descriptor,
+                              results_dir='', run_locdis_checks=False,
+                              save_output_files=False,
+                              vocabulary_cache_dir=vocabulary_cache_dir)
+    WORKER_LABELER.initialize_vocabulary_dicts()
+
+def term_search_worker(shard_input):
+    """Run RadLabel.label_reports() on one shard of reports.
+    <shard_input> is a tuple of (filenames, sick_sentences)"""
+    filenames, sick_sentences = shard_input
+    return WORKER_LABELER.label_reports(filenames, sick_sentences)
+
+#########################
+# Streaming Term Search #-------------------------------------------------------
+#########################
+def term_search_chunks(chunks, setname, dataset_descriptor, results_dir,
+                       run_locdis_checks, description=None, workers=1,
+                       vocabulary_cache_dir=None):
+    """Run the term search on a set that is too large to fit in memory.
+    <chunks> is an iterable of dataframes in the format that RadLabel takes
+        for <data> (e.g. from read_csv_in_report_chunks()). All the sentences
+        of a report must be in the same chunk.
+    Each chunk is labeled by its own RadLabel and its output is appended to
+    the output files, so peak memory depends on the chunk size and not on the
+    size of the set. The output files are the same as for RadLabel, except
+    that the labels are only saved in the label_store.PackedLabels format
+    (the pickled dictionary would need the whole set in memory), and the
+    output file prefix is <description>, by default 'imgtrain_note'+setname.
+    The test set is not supported since evaluation needs the whole test set.
+    Returns the number of reports labeled."""
+    assert setname in ['train','predict']
+    if description is None:
+        description = 'imgtrain_note'+setname
+    writer = None
+    seen_files = set()
+    wrong_values = {'lung':0, 'heart':0, 'great_vessel':0}
+    first_chunk = True
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        chunk_files = set(chunk['Filename'].values.tolist())
+        assert seen_files.isdisjoint(chunk_files), 'Chunks must not split reports'
+        seen_files.update(chunk_files)
+        m = RadLabel(chunk, setname, dataset_descriptor, results_dir,
+                     run_locdis_checks, save_output_files=False, workers=workers,
+                     vocabulary_cache_dir=vocabulary_cache_dir)
+        if writer is None:
+            writer = label_store.PackedLabelsWriter(os.path.join(results_dir, description),
+                                                    m.out_bin.diseases, m.out_bin.locations)
+        writer.append(m.out_bin)
+        #Append the CSV outputs (with the header only in the first chunk)
+        mode = 'w' if first_chunk else 'a'
+        m.disease_out.to_csv(os.path.join(results_dir, description+'_DiseaseBinaryLabels.csv'), mode=mode, header=first_chunk)
+        m.data.to_csv(os.path.join(results_dir, description+'_merged.csv'), mode=mode, header=first_chunk)
+        m.missing.to_csv(os.path.join(results_dir, description+'_Missingness.csv'), mode=mode, header=first_chunk)
+        wrong_values['lung']+=m.wrong_lung_values
+        wrong_values['heart']+=m.wrong_heart_values
+        wrong_values['great_vessel']+=m.wrong_vessel_values
+        first_chunk = False
+    if writer is not None:
+        writer.close()
+    print('Streaming term search for',setname,'labeled',len(seen_files),'reports')
+    for system, count in wrong_values.items():
+        print('\twrong_'+system+'_values (corrected):',count)
+    return len(seen_files)
+
+def read_csv_in_report_chunks(path, chunksize, **kwargs):
+    """Yield dataframes of about <chunksize> rows of the CSV file at <path>,
+    in which the rows of each report (identified by the 'Filename' column)
+    are never split across dataframes. The rows of a report must be next to
+    each other in the file. <kwargs> are passed to pd.read_csv()"""
+    leftover = None
+    for chunk in pd.read_csv(path, chunksize=chunksize, **kwargs):
+        if leftover is not None:
+            chunk = pd.concat([leftover, chunk])
+        #the last report of this chunk may continue in the next chunk
+        in_last_report = (chunk['Filename'] == chunk['Filename'].values[-1]).values
+        leftover = chunk[in_last_report]
+        if not in_last_report.all():
+            yield chunk[~in_last_report]
+    if leftover is not None:
+        yield leftover
+
 ########################################
 # Create imgtrain Overall Output Files #----------------------------------------
 ########################################
@@ -595,14 +775,12 @@ def combine_imgtrain_files(term_search_dir):
     in certain circumstances after SARLE has totally finished running
     in order to aggregate certain output files."""
     #Aggregate all training labels (location x disease) and save
-    imgtrain_notetrain = pickle.load(open(os.path.join(term_search_dir, 'imgtrain_notetrain_BinaryLabels.pkl'), 'rb'))
-    imgtrain_notetest = pickle.load(open(os.path.join(term_search_dir, 'imgtrain_notetest_BinaryLabels.pkl'), 'rb'))
-    imgtrain_extra = pickle.load(open(os.path.join(term_search_dir, 'imgtrain_extra_BinaryLabels.pkl'), 'rb'))
-    out_bin = {}
-    out_bin.update(imgtrain_notetrain)
-    out_bin.update(imgtrain_notetest)
-    out_bin.update(imgtrain_extra)
-    pickle.dump(out_bin, open(os.path.join(term_search_dir, 'imgtrain_BinaryLabels.pkl'),'wb'))
+    imgtrain_notetrain = label_store.load_binary_labels(os.path.join(term_search_dir, 'imgtrain_notetrain'))
+    imgtrain_notetest = label_store.load_binary_labels(os.path.join(term_search_dir, 'imgtrain_notetest'))
+    imgtrain_extra = label_store.load_binary_labels(os.path.join(term_search_dir, 'imgtrain_extra'))
+    out_bin = label_store.BinaryLabels.concat([imgtrain_notetrain, imgtrain_notetest, imgtrain_extra])
+    pickle.dump(out_bin.to_dict(), open(os.path.join(term_search_dir, 'imgtrain_BinaryLabels.pkl'),'wb'))
+    out_bin.save_packed(os.path.join(term_search_dir, 'imgtrain'))
     
     #Aggregate disease_out (disease binary labels) and save
     train_disease_out = (pd.concat([pd.read_csv(os.path.join(term_search_dir, 'imgtrain_notetrain_DiseaseBinaryLabels.csv'),
@@ -34,7 +34,7 @@ matplotlib.rcParams.update({'font.size': 18})
 
 import seaborn
 
-from src import load
+from src import load, label_store
 
 class RepeatedSentenceHistograms(object):
     def __init__(self, dataset, results_dir):
@@ -100,8 +100,12 @@ class LocationDiseaseSummary(object):
         print('Running summary for',setname)
         self.setname = setname
         self.results_dir = results_dir
-        self.out_bin = out_bin #dictionary of dataframes
-        self.uniq_set_files = list(set(list(self.out_bin.keys())))
+        #label_store.BinaryLabels, or the old dictionary of dataframes that is
+        #saved in the _BinaryLabels.pkl files
+        if isinstance(out_bin, dict):
+            out_bin = label_store.BinaryLabels.from_dict(out_bin)
+        self.out_bin = out_bin
+        self.uniq_set_files = self.out_bin.keys()
         self.missing = missing
         
         #Run:
@@ -115,14 +119,11 @@ class LocationDiseaseSummary(object):
     # Heatmap #-----------------------------------------------------------------
     def make_location_and_disease_heatmap(self):
         print('Working on location and disease heatmap')
-        #Stack all the location x disease dataframes on top of each other and
-        #sum them together, then mkae a heatmap
-        temp = self.out_bin[list(self.out_bin.keys())[0]]
-        total = np.zeros(temp.shape)
-        for key in list(self.out_bin.keys()):
-            total += self.out_bin[key].values
-        total = pd.DataFrame(total, columns = temp.columns.values.tolist(),
-                             index = temp.index.values.tolist())
+        #Sum the location x disease labels of all the reports together, then
+        #make a heatmap
+        total = pd.DataFrame(self.out_bin.array.sum(axis=0, dtype='float'),
+                             columns = self.out_bin.locations,
+                             index = self.out_bin.diseases)
         LocationDiseaseSummary.heatmap(total, os.path.join(self.results_dir,self.setname+'_Total_Heatmap.pdf'))
     
     @staticmethod
@@ -155,9 +156,8 @@ class LocationDiseaseSummary(object):
     def make_location_summary(self):
         """Make tables and bar plots summarizing the location counts"""
         print('Working on make_location_summary()')
-        temp = self.out_bin[list(self.out_bin.keys())[0]]
-        all_locations = temp.columns.values.tolist()
-        location_out = self.binarize_complex_labels(chosen_labels = all_locations, label_type = 'location')
+        all_locations = self.out_bin.locations
+        location_out = self.out_bin.binarize(chosen_labels = all_locations, label_type = 'location')
         location_out = filter_for_only_present_volumes(location_out)
         LocationDiseaseSummary.df_column_summary(location_out, os.path.join(self.results_dir, self.setname+'_Frequency_Locations.csv'))
         LocationDiseaseSummary.bar_plot(location_out.sum(axis = 0), os.path.join(self.results_dir, self.setname+'_BarPlotFreq_Locations.pdf'), location_out.shape[0])
@@ -169,26 +169,6 @@ class LocationDiseaseSummary(object):
            missing = filter_for_only_present_volumes(missing)
            LocationDiseaseSummary.df_column_summary(missing, os.path.join(self.results_dir, self.setname+'_Summary_of_Missingness.csv'))
         
-    #Stolen from term_search.py
-    def binarize_complex_labels(self, chosen_labels, label_type):
-        """Return a dataframe with index of filenames (from self.uniq_set_files)
-        and columns of <chosen_labels>. This is the old-fashioned output format.
-        <label_type> is the type of the chosen_labels. It is either 'disease'
-        (to access rows) or 'location' (to access columns)"""
-        assert label_type in ['disease','location']
-        binarized = pd.DataFrame(np.zeros((len(self.uniq_set_files),len(chosen_labels))),
-                        index = self.uniq_set_files, columns = chosen_labels)
-        for filename in self.uniq_set_files:
-            for label in chosen_labels:
-                if label_type == 'location':
-                    value = np.sum(self.out_bin[filename].loc[:,label])
-                elif label_type == 'disease':
-                    value = np.sum(self.out_bin[filename].loc[label,:])
-                if value > 0:
-                    value = 1
-                binarized.at[filename, label] = value
-        return binarized
-    
     @staticmethod
     def df_column_summary(df, savepath):
         """Calculate the sum of the columns and the percent of total for each
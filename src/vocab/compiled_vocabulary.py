@@ -0,0 +1,239 @@
+#compiled_vocabulary.py
+#Copyright (c) 2020 Rachel Lea Ballantyne Draelos
+
+#MIT License
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE
+
+import os
+import sys
+import pickle
+import hashlib
+import inspect
+import numpy as np
+
+from src import aho_corasick, cache_files
+
+"""Everything the term search derives from a vocabulary module
+(vocabulary_ct or vocabulary_cxr), built once and reused: the aggregated
+location and disease dictionaries, integer ids for the diseases and locations,
+the term table of the Aho-Corasick matcher, the forbidden location x disease
+masks, and the lobe -> lung rollups."""
+
+#Compiled vocabularies that were already built or loaded in this process,
+#keyed by cache key
+LOADED = {}
+
+def load_compiled_vocabulary(vocabmodule, cache_dir=None):
+    """Return the CompiledVocabulary for <vocabmodule>.
+    If <cache_dir> is provided, the compiled vocabulary is pickled there
+    the first time it is built and loaded from there afterwards, e.g. by
+    later runs and by the worker processes of a parallel term search.
+    The cache file name includes the cache key of the vocabulary (see
+    return_cache_key()), so any edit to the vocabulary or to the code that
+    compiles it results in a new compiled vocabulary."""
+    cache_key = return_cache_key(vocabmodule)
+    if cache_key in LOADED:
+        return LOADED[cache_key]
+    vocabulary = None
+    if cache_dir is not None:
+        cache_path = os.path.join(cache_dir, 'CompiledVocabulary_'+cache_key+'.pkl')
+        if os.path.isfile(cache_path):
+            vocabulary = pickle.load(open(cache_path, 'rb'))
+    if vocabulary is None:
+        vocabulary = CompiledVocabulary(vocabmodule)
+        if cache_dir is not None:
+            cache_files.save_pickle_atomically(vocabulary, cache_path)
+    LOADED[cache_key] = vocabulary
+    return vocabulary
+
+def fingerprint_vocabulary(vocabmodule):
+    """Return a sha1 hash of the term dictionaries and forbidden pathologies
+    of <vocabmodule>"""
+    source = [vocabmodule.return_lung_terms(), vocabmodule.return_heart_terms(),
+              vocabmodule.return_great_vessel_terms(), vocabmodule.return_generic_terms()]
+    for system in ['great_vessel','heart','lung']:
+        source.append(vocabmodule.return_forbidden(system))
+    return hashlib.sha1(repr(source).encode('utf-8')).hexdigest()
+
+def return_cache_key(vocabmodule):
+    """Return a sha1 hash of the fingerprint of <vocabmodule> and of the code
+    of this module and of the Aho-Corasick matcher, which determine the
+    contents of a pickled CompiledVocabulary"""
+    source = [fingerprint_vocabulary(vocabmodule)]
+    source += [inspect.getsource(module) for module in [aho_corasick, sys.modules[__name__]]]
+    return hashlib.sha1(repr(source).encode('utf-8')).hexdigest()
+
+class CompiledVocabulary(object):
+    def __init__(self, vocabmodule):
+        """Variables:
+        <vocabmodule> is the vocabulary module, either vocabulary_ct or
+            vocabulary_cxr"""
+        self.vocabulary_name = vocabmodule.__name__
+        self.fingerprint = fingerprint_vocabulary(vocabmodule)
+        
+        #Term dictionaries
+        self.lung_loc_dict, self.lung_disease_dict = vocabmodule.return_lung_terms()
+        self.heart_loc_dict, self.heart_disease_dict = vocabmodule.return_heart_terms()
+        self.vessel_loc_dict = vocabmodule.return_great_vessel_terms()
+        self.generic_loc_dict, self.generic_disease_dict = vocabmodule.return_generic_terms()
+        self.mega_loc_dict = aggregate_dicts([self.lung_loc_dict,
+                        self.heart_loc_dict, self.vessel_loc_dict, self.generic_loc_dict])
+        self.mega_disease_dict = aggregate_dicts([self.lung_disease_dict,
+                        self.heart_disease_dict, self.generic_disease_dict])
+        
+        #Integer ids, in the order of the label_store.BinaryLabels axes
+        self.diseases = list(self.mega_disease_dict.keys())+['other_disease']
+        self.locations = list(self.mega_loc_dict.keys())+['other_location']
+        self.disease_index = {d:idx for idx, d in enumerate(self.diseases)}
+        self.location_index = {l:idx for idx, l in enumerate(self.locations)}
+        
+        #One automaton over every location and disease term
+        self.term_matcher = TermMatcher({'location':self.mega_loc_dict,
+                                         'disease':self.mega_disease_dict})
+        
+        #Forbidden location x disease combinations
+        self.forbidden = {}
+        for system in ['great_vessel','heart','lung']:
+            self.forbidden[system] = vocabmodule.return_forbidden(system)
+        self.forbidden_masks = self.return_forbidden_masks()
+        
+        #Lobe -> lung rollups. If a lobe is positive then that lung is positive
+        self.lobe_rollups = {'right_lung':['right_upper','right_mid','right_lower'],
+                             'left_lung':['left_upper','left_mid','left_lower']}
+        self.lobe_rollup_ids = {self.location_index[side_lung]:self.ids_for(self.location_index, lobes)
+                                for side_lung, lobes in self.lobe_rollups.items()}
+        
+        #Diseases that imply a location
+        self.lung_disease_ids = self.ids_for(self.disease_index, self.lung_disease_dict.keys())
+        self.heart_disease_ids = self.ids_for(self.disease_index, self.heart_disease_dict.keys())
+    
+    def ids_for(self, index, names):
+        """Return an integer array of the ids of <names> in <index>, which
+        is either self.disease_index or self.location_index"""
+        return np.array([index[name] for name in names], dtype='int')
+    
+    def return_forbidden_masks(self):
+        """Return a dictionary where the keys are the body systems 'lung',
+        'heart', and 'great_vessel' and the values are boolean disease x
+        location arrays (in the order of self.diseases and self.locations)
+        that are True for the forbidden combinations of that body system:
+            lung: lung diseases in heart or generic locations, and generic
+                diseases that are not in LUNG_ALLOWED_PATH in lung locations
+            heart: heart diseases in lung or generic locations, and generic
+                diseases that are not in HEART_ALLOWED_PATH in heart locations
+            great_vessel: generic diseases that are not in
+                GREAT_VESSEL_ALLOWED_PATH in great vessel locations"""
+        def mask_for(diseases, locations):
+            mask = np.zeros((len(self.diseases),len(self.locations)), dtype='bool')
+            mask[np.ix_(self.ids_for(self.disease_index, diseases),
+                        self.ids_for(self.location_index, locations))] = True
+            return mask
+        generic_locs = list(self.generic_loc_dict.keys())
+        lung_locs = list(self.lung_loc_dict.keys())
+        heart_locs = list(self.heart_loc_dict.keys())
+        forbidden_masks = {}
+        forbidden_masks['lung'] = (mask_for(self.lung_disease_dict.keys(), heart_locs+generic_locs)
+                    | mask_for(self.forbidden['lung'], lung_locs))
+        forbidden_masks['heart'] = (mask_for(self.heart_disease_dict.keys(), lung_locs+generic_locs)
+                    | mask_for(self.forbidden['heart'], heart_locs))
+        forbidden_masks['great_vessel'] = mask_for(self.forbidden['great_vessel'], self.vessel_loc_dict.keys())
+        return forbidden_masks
+
+def aggregate_dicts(dicts):
+    super_dict = {}
+    keylens = 0
+    for d in dicts:
+        keylens+=len(list(d.keys()))
+        for k, v in d.items():
+            super_dict[k] = v
+    assert len(list(super_dict.keys())) == keylens
+    return super_dict
+
+#################
+# Term Matching #---------------------------------------------------------------
+#################
+class TermMatcher(object):
+    """Find every vocabulary term in a sentence with a single pass of an
+    Aho-Corasick automaton, and then decide each keyterm from the set of terms
+    that were found. The keyterm decisions are identical to
+    RadLabel.label_for_keyterm_and_sentence(), which scans the sentence once
+    for every 'Any', 'Term1', 'Term2', and 'Exclude' string."""
+    def __init__(self, termdicts):
+        """<termdicts> is a dictionary of named term dictionaries, e.g.
+        {'location':mega_loc_dict, 'disease':mega_disease_dict}. The names
+        are needed because the same keyterm can be both a location and a
+        disease with different terms (e.g. 'mediastinum' in vocabulary_cxr)"""
+        self.terms = [] #every distinct term string
+        term_ids = {} #term string --> position in self.terms
+        def ids_for(termlist):
+            for term in termlist:
+                if term not in term_ids:
+                    term_ids[term] = len(self.terms)
+                    self.terms.append(term)
+            return frozenset([term_ids[term] for term in termlist])
+        
+        #self.keyterms[name][keyterm] = (Any ids, Term1 ids, Term2 ids, Exclude ids)
+        self.keyterms = {}
+        for name, termdict in termdicts.items():
+            self.keyterms[name] = {}
+            for keyterm, spec in termdict.items():
+                self.keyterms[name][keyterm] = (ids_for(spec['Any']),
+                                          ids_for(spec.get('Term1',[])),
+                                          ids_for(spec.get('Term2',[])),
+                                          ids_for(spec.get('Exclude',[])))
+        self.automaton = aho_corasick.Automaton(self.terms)
+        
+        #The same sets as boolean matrices, used by label_vector(). For each
+        #name, self.matrices[name] has shape (4 x keyterms, terms): the Any,
+        #Term1, Term2, and Exclude rows of all the keyterms stacked together
+        self.matrices = {}
+        for name in self.keyterms.keys():
+            keyterm_sets = list(self.keyterms[name].values())
+            matrix = np.zeros((4, len(keyterm_sets), len(self.terms)), dtype='bool')
+            for idx, sets in enumerate(keyterm_sets):
+                for part in range(4):
+                    matrix[part, idx, list(sets[part])] = True
+            self.matrices[name] = matrix.reshape(4*len(keyterm_sets), len(self.terms))
+    
+    def find_hits(self, sentence):
+        """Return the set of ids of the terms that occur in <sentence>.
+        Pads the sentence the same way label_for_keyterm_and_sentence() does."""
+        return self.automaton.find(' ' + sentence + ' ')
+    
+    def label(self, name, keyterm, hits):
+        """Return label = 1 if <keyterm> from the term dictionary <name> is
+        present given the term <hits> of a sentence else return label = 0"""
+        any_ids, term1_ids, term2_ids, exclude_ids = self.keyterms[name][keyterm]
+        if not exclude_ids.isdisjoint(hits):
+            return 0
+        if not any_ids.isdisjoint(hits):
+            return 1
+        if (not term1_ids.isdisjoint(hits)) and (not term2_ids.isdisjoint(hits)):
+            return 1
+        return 0
+    
+    def label_vector(self, name, hits):
+        """Return a boolean array with the label of every keyterm of the term
+        dictionary <name>, in the order of that dictionary, given the term
+        <hits> of a sentence. Same as calling label() for each keyterm."""
+        matrix = self.matrices[name]
+        found = matrix[:,np.fromiter(hits, dtype='int', count=len(hits))].any(axis=1)
+        any_found, term1_found, term2_found, exclude_found = found.reshape(4,-1)
+        return (any_found | (term1_found & term2_found)) & (~exclude_found)
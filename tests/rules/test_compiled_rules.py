@@ -0,0 +1,112 @@
+#test_compiled_rules.py
+#Copyright (c) 2020 Rachel Lea Ballantyne Draelos
+
+#MIT License
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE
+
+import os
+import pickle
+import shutil
+import unittest
+import pandas as pd
+
+from src import load, sentence_rules
+from src.rules import rules_ct, rules_cxr, compiled_rules
+
+class TestCompiledRules(unittest.TestCase):
+    def test_compiled_rules_on_openi(self):
+        #The compiled rules must give exactly the same output as calling every
+        #rule in order, for every sentence of the OpenI data set and some
+        #made up sentences that exercise the special handling functions
+        train, test, _ = load.load_merged_with_style('openi_cxr','trainall_testall')
+        sentences = pd.concat([train,test])['Sentence'].values.tolist()
+        sentences += ['patent airways','the svc is patent with a stent','clear lungs',
+            'the lungs are clear status post lobectomy','subcentimeter nodes',
+            'a few scattered subcentimeter lymph nodes are visualized','noncalcified nodule',
+            'non calcified nodule','no effusion and change in nodule','not excluded',
+            'please see prior','nodule was not seen','normal','']
+        for rules_order, rules_def in [(rules_ct.RULES_ORDER_CT, rules_ct.RULES_DEF_CT),
+                (rules_cxr.RULES_ORDER_CXR_AMBPOS, rules_cxr.RULES_DEF_CXR_AMBPOS),
+                (rules_cxr.RULES_ORDER_CXR_AMBNEG, rules_cxr.RULES_DEF_CXR_AMBNEG)]:
+            compiled = compiled_rules.CompiledRules(rules_order, rules_def)
+            for sentence in sentences:
+                sentence = ' '+sentence+' '
+                correct = compiled_rules.apply_rules_in_order(sentence, rules_order, rules_def)
+                assert compiled.apply(sentence) == correct, sentence
+        print('Passed test_compiled_rules_on_openi()')
+    
+    def test_column_runtime_on_openi(self):
+        #Applying each rule to all the sentences at once gives exactly the
+        #same output as calling every rule in order on each sentence
+        train, test, _ = load.load_merged_with_style('openi_cxr','trainall_testall')
+        sentences = [' '+x+' ' for x in pd.concat([train,test])['Sentence'].unique().tolist()]
+        sentences += [' no no effusion ',' there is scarring vs  atelectasis ',' ',
+                      ' a few scattered subcentimeter lymph nodes are visualized ']
+        for rules_order, rules_def in [(rules_ct.RULES_ORDER_CT, rules_ct.RULES_DEF_CT),
+                (rules_cxr.RULES_ORDER_CXR_AMBPOS, rules_cxr.RULES_DEF_CXR_AMBPOS),
+                (rules_cxr.RULES_ORDER_CXR_AMBNEG, rules_cxr.RULES_DEF_CXR_AMBNEG)]:
+            compiled = compiled_rules.CompiledRules(rules_order, rules_def, runtime='column')
+            correct = [compiled_rules.apply_rules_in_order(x, rules_order, rules_def) for x in sentences]
+            assert compiled.apply_many(sentences) == correct
+        print('Passed test_column_runtime_on_openi()')
+
+    def test_rule_results_cache(self):
+        cache_dir = 'testing_delthis'
+        data = pd.DataFrame([['no pleural effusion','AA11'],['left pleural effusion','AA11'],
+                             ['no pleural effusion','BB22']], columns=['Sentence','Filename'])
+        compiled_rules.LOADED.clear()
+        first = sentence_rules.ApplyRules(data.copy(), 'predict', 'cxr_amb_pos_rules', cache_dir).data_processed
+        assert first['PredLabel'].values.tolist() == [0,1,0]
+        #A new process (simulated by clearing LOADED) reuses the saved results
+        compiled_rules.LOADED.clear()
+        compiled = compiled_rules.load_compiled_rules(rules_cxr.RULES_ORDER_CXR_AMBPOS, rules_cxr.RULES_DEF_CXR_AMBPOS, cache_dir)
+        assert sorted(compiled.results.keys()) == [' left pleural effusion ',' no pleural effusion ']
+        second = sentence_rules.ApplyRules(data.copy(), 'predict', 'cxr_amb_pos_rules', cache_dir).data_processed
+        assert second['Sentence'].values.tolist() == first['Sentence'].values.tolist()
+        assert len(os.listdir(cache_dir)) == 1
+        #Only the new results are saved, in a new shard
+        more = pd.DataFrame([['right pleural effusion','CC33']], columns=['Sentence','Filename'])
+        sentence_rules.ApplyRules(more, 'predict', 'cxr_amb_pos_rules', cache_dir)
+        shards = [os.path.join(cache_dir,x) for x in os.listdir(cache_dir)]
+        assert sorted([len(pickle.load(open(x,'rb'))) for x in shards]) == [1,2]
+        #Without a cache directory no results are kept in memory
+        compiled_rules.LOADED.clear()
+        sentence_rules.ApplyRules(data.copy(), 'predict', 'cxr_amb_pos_rules').data_processed
+        assert compiled_rules.load_compiled_rules(rules_cxr.RULES_ORDER_CXR_AMBPOS, rules_cxr.RULES_DEF_CXR_AMBPOS).results == {}
+        #A different rule set does not use the same results
+        assert compiled_rules.fingerprint_rules(rules_cxr.RULES_ORDER_CXR_AMBNEG, rules_cxr.RULES_DEF_CXR_AMBNEG) != compiled.fingerprint
+        shutil.rmtree(cache_dir)
+        print('Passed test_rule_results_cache()')
+
+    def test_apply_rules_workers(self):
+        #Applying the rules in several processes gives the same output as
+        #applying them in the current process
+        train, test, _ = load.load_merged_with_style('openi_cxr','trainall_testall')
+        data = pd.concat([train,test]).head(2000)
+        compiled_rules.LOADED.clear()
+        serial = sentence_rules.ApplyRules(data.copy(), 'predict', 'cxr_amb_neg_rules').data_processed
+        compiled_rules.LOADED.clear()
+        parallel = sentence_rules.ApplyRules(data.copy(), 'predict', 'cxr_amb_neg_rules', workers=3).data_processed
+        for column in ['Sentence','PredLabelConservative','PredLabel']:
+            assert serial[column].values.tolist() == parallel[column].values.tolist(), column
+        print('Passed test_apply_rules_workers()')
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+#test_token_rules.py
+#Copyright (c) 2020 Rachel Lea Ballantyne Draelos
+
+#MIT License
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE
+
+import unittest
+import pandas as pd
+
+from src import load
+from src.rules import rules_ct, rules_cxr, rule_functions, token_rules, compiled_rules
+
+class TestTokenRules(unittest.TestCase):
+    def test_token_rule_functions(self):
+        #Each token rule function gives the same output as the string version,
+        #including for repeated mainwords, extra whitespace, and mainwords
+        #inside of words
+        cases = [(rule_functions.delete_part, {'delete_part':'before','mainword':'aa'}, ' baaab aaa c '),
+            (rule_functions.delete_part, {'delete_part':'after','mainword':'no '}, ' there is no  effusion no '),
+            (rule_functions.delete_part_until, {'delete_part':'after','mainword':'without','until_hit':['status','with']}, ' without  change with status without x '),
+            (rule_functions.delete_part_until, {'delete_part':'before','mainword':'normal','until_hit':['nodule','with','status']}, ' nodule is normal and normal '),
+            (rule_functions.delete_part_until, {'delete_part':'before','mainword':'normal','until_hit':['zzzzz']}, ' a normal b '),
+            (rule_functions.delete_entire_unless_immediate, {'mainword':' unremarkable','position':'after','wrange':2,'unless_in':['except','but']}, ' liver is unremarkable\texcept cyst '),
+            (rule_functions.delete_entire_unless_immediate, {'mainword':' removed','position':'before','wrange':1,'unless_in':['not']}, ' not removed '),
+            (rule_functions.non_handling, {'mainword':'non'}, ' nonspecific  nonspecific noncalcified node '),
+            (rule_functions.non_handling, {'mainword':'non'}, ' there is non calcified nodule '),
+            (rule_functions.patent_handling, {'mainword':' patent'}, ' patent airways status post stent '),
+            (rule_functions.patent_handling, {'mainword':' patent'}, ' the svc is patent with a stent '),
+            (rule_functions.clear_handling, {'mainword':' clear'}, ' lungs clear status post clearance '),
+            (rule_functions.clear_handling, {'mainword':' clear'}, ' a clearclear '),
+            (rule_functions.subcentimeter_handling, {'mainword':' subcentimeter'}, ' few subcentimeter lymph nodes are stable '),
+            (rule_functions.delete_mainword, {'mainword':'there is '}, ' there is effusion ')]
+        for func, kwargs, sentence in cases:
+            correct = func(sentence=sentence, **kwargs)
+            sent = token_rules.TokenSentence(sentence)
+            mainword = kwargs.pop('mainword')
+            modified = token_rules.apply_rule(sent, func, mainword, kwargs)
+            assert (modified, sent.text()) == correct, sentence
+        print('Passed test_token_rule_functions()')
+    
+    def test_token_runtime_on_openi(self):
+        #The token runtime gives exactly the same output as calling every rule
+        #in order, for every sentence of the OpenI data set
+        train, test, _ = load.load_merged_with_style('openi_cxr','trainall_testall')
+        sentences = pd.concat([train,test])['Sentence'].unique().tolist()
+        for rules_order, rules_def in [(rules_ct.RULES_ORDER_CT, rules_ct.RULES_DEF_CT),
+                (rules_cxr.RULES_ORDER_CXR_AMBPOS, rules_cxr.RULES_DEF_CXR_AMBPOS),
+                (rules_cxr.RULES_ORDER_CXR_AMBNEG, rules_cxr.RULES_DEF_CXR_AMBNEG)]:
+            compiled = compiled_rules.CompiledRules(rules_order, rules_def, runtime='token')
+            for sentence in sentences:
+                sentence = ' '+sentence+' '
+                correct = compiled_rules.apply_rules_in_order(sentence, rules_order, rules_def)
+                assert compiled.apply(sentence) == correct, sentence
+        print('Passed test_token_runtime_on_openi()')
+
+if __name__=='__main__':
+    unittest.main()
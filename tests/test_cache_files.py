@@ -0,0 +1,51 @@
+#test_cache_files.py
+#Copyright (c) 2020 Rachel Lea Ballantyne Draelos
+
+#MIT License
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE
+
+import os
+import pickle
+import shutil
+import unittest
+
+from src import cache_files
+
+class TestCacheFiles(unittest.TestCase):
+    def test_save_pickle_atomically(self):
+        cache_dir = 'testing_delthis'
+        path = os.path.join(cache_dir, 'nested', 'Results.pkl')
+        #the directory is created and no temporary file is left behind
+        cache_files.save_pickle_atomically({'a':1}, path)
+        assert os.listdir(os.path.dirname(path)) == ['Results.pkl']
+        with open(path, 'rb') as f:
+            assert pickle.load(f) == {'a':1}
+        #an existing file is replaced
+        cache_files.save_pickle_atomically({'b':2}, path)
+        with open(path, 'rb') as f:
+            assert pickle.load(f) == {'b':2}
+        cache_files.copy_file_atomically(path, os.path.join(cache_dir, 'Copy.pkl'))
+        with open(os.path.join(cache_dir, 'Copy.pkl'), 'rb') as f:
+            assert pickle.load(f) == {'b':2}
+        shutil.rmtree(cache_dir)
+        print('Passed test_save_pickle_atomically()')
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#test_hashing_classifier.py
+#Copyright (c) 2020 Rachel Lea Ballantyne Draelos
+
+#MIT License
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE
+
+import os
+import shutil
+import unittest
+import numpy as np
+import pandas as pd
+
+from src import load, evaluation, sentence_classifier, hashing_classifier
+from src.rules import rules_cxr, compiled_rules
+
+class TestHashingClassifier(unittest.TestCase):
+    def test_hashing_classifier(self):
+        train, test, _ = load.load_merged_with_style('openi_cxr','trainall_testall')
+        model = hashing_classifier.HashingClassifier().train(train['Sentence'].values.tolist(), train['Label'].values.tolist())
+        #Same output format as the predict() method of a Fasttext model
+        labels, probs = model.predict(['no pleural effusion','there is a large right pleural effusion'])
+        assert [x[0] for x in labels] == ['__label__h','__label__s']
+        assert all([0.5 <= x[0] <= 1 for x in probs])
+        n, precision, recall = model.test(test['Sentence'].values.tolist(), test['Label'].values.tolist())
+        assert n == test.shape[0] and precision > 0.95
+        print('Passed test_hashing_classifier()')
+    
+    def test_hashing_backend(self):
+        results_dir = 'testing_delthis'
+        registry_dir = os.path.join(results_dir,'registry')
+        cache_dir = os.path.join(results_dir,'cache')
+        os.makedirs(results_dir, exist_ok=True)
+        train, test, predict = load.load_merged_with_style('openi_cxr','trainall_testall')
+        outputs = []
+        for run in range(2):
+            m = sentence_classifier.ClassifySentences(train.copy(), test.copy(), predict.copy(),
+                        results_dir, 'pos', prediction_cache_dir=cache_dir,
+                        model_registry_dir=registry_dir, backend='hashing')
+            m.run_all()
+            outputs.append(m.test_data)
+            #The classifier is saved in the registry and loaded by the second run
+            assert len(os.listdir(registry_dir)) == 1
+            #The prediction cache file is named after the backend
+            assert [x.split('_')[0] for x in os.listdir(cache_dir)] == ['HashingPredictions']
+        acc, auc, ap = evaluation.calculate_eval_metrics(outputs[0]['PredLabel'].values.tolist(),
+                    outputs[0]['PredProb'].values.tolist(), outputs[0]['BinLabel'].values.tolist())
+        assert auc > 0.95
+        assert np.allclose(outputs[0]['PredProb'].values, outputs[1]['PredProb'].values)
+        shutil.rmtree(results_dir)
+        print('Passed test_hashing_backend()')
+
+    def test_ambiguity_filter(self):
+        #With ambiguities 'neg' the ambiguous parts of the sentences are
+        #deleted by the AMB_DEF rules, with any rules runtime
+        results_dir = 'testing_delthis'
+        os.makedirs(results_dir, exist_ok=True)
+        train, test, _ = load.load_merged_with_style('openi_cxr','trainall_testall')
+        predict = pd.DataFrame({'Sentence':['pneumonia is not excluded','right pleural effusion',
+                                            'opacity may represent atelectasis'],'Filename':['A','B','C']})
+        correct = [' '.join(compiled_rules.apply_rules_in_order(' '+x+' ', rules_cxr.AMB_ORDER, rules_cxr.AMB_DEF)[1].split())
+                   for x in test['Sentence'].values.tolist()]
+        for runtime in ['string','token','column']:
+            m = sentence_classifier.ClassifySentences(train.copy(), test.copy(), predict.copy(),
+                        results_dir, 'neg', backend='hashing', rules_runtime=runtime)
+            m.run_all()
+            assert m.predict_data['Sentence'].values.tolist() == ['','right pleural effusion','opacity']
+            assert m.test_data['Sentence'].values.tolist() == correct
+        shutil.rmtree(results_dir)
+        print('Passed test_ambiguity_filter()')
+
+if __name__=='__main__':
+    unittest.main()
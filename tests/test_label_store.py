@@ -0,0 +1,120 @@
+#test_label_store.py
+#Copyright (c) 2020 Rachel Lea Ballantyne Draelos
+
+#MIT License
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE
+
+import os
+import pickle
+import shutil
+import unittest
+import numpy as np
+import pandas as pd
+
+from src import label_store
+
+from tests import equality_checks as eqc
+
+class TestLabelStore(unittest.TestCase):
+    def test_binary_labels(self):
+        values = np.zeros((3,2,3),dtype='uint8')
+        values[0,0,1] = 1
+        values[2,1,0] = 1
+        values[2,1,2] = 1
+        out_bin = label_store.BinaryLabels(['AA11','BB22','CC33'],
+                        ['nodule','other_disease'], ['lung','heart','other_location'], values)
+        
+        #Dictionary-like access returns one dataframe per report
+        correct = pd.DataFrame([[0,0,0],[1,0,1]], index=['nodule','other_disease'],
+                               columns=['lung','heart','other_location'])
+        assert eqc.dfs_equal(out_bin['CC33'], correct)
+        assert out_bin.keys() == ['AA11','BB22','CC33']
+        assert 'BB22' in out_bin and 'DD44' not in out_bin
+        
+        #Select and concat
+        selected = out_bin.select(['CC33','AA11'])
+        assert selected.keys() == ['CC33','AA11']
+        assert eqc.dfs_equal(selected['CC33'], correct)
+        combined = label_store.BinaryLabels.concat([selected, out_bin.select(['BB22'])])
+        assert combined.keys() == ['CC33','AA11','BB22']
+        assert eqc.arrays_equal(combined.array.reshape(3,-1), values[[2,0,1]].reshape(3,-1), tol=0)
+        #If a report is in more than one, the last one wins, like dict.update()
+        overlap = label_store.BinaryLabels.concat([out_bin, selected.select(['CC33']), out_bin.select(['AA11'])])
+        assert overlap.keys() == ['AA11','BB22','CC33']
+        assert eqc.arrays_equal(overlap.array.reshape(3,-1), values.reshape(3,-1), tol=0)
+        
+        #Pickling round trip
+        reloaded = pickle.loads(pickle.dumps(out_bin))
+        assert eqc.dfs_equal(reloaded['AA11'], out_bin['AA11'])
+        assert reloaded.filename_index['CC33'] == 2
+        
+        #values() and update() behave like those of the old dictionary
+        assert eqc.dfs_equal(list(out_bin.values())[2], correct)
+        changed = correct.copy()
+        changed.loc['nodule','heart'] = 1
+        old_dict = out_bin.to_dict()
+        out_bin.update({'CC33':changed, 'DD44':correct})
+        assert out_bin.keys() == ['AA11','BB22','CC33','DD44']
+        assert eqc.dfs_equal(out_bin['CC33'], changed)
+        assert eqc.dfs_equal(out_bin['DD44'], correct)
+        assert out_bin.presence('location')[2].tolist() == [True, True, True]
+        assert eqc.dfs_equal(label_store.BinaryLabels.from_dict(old_dict,
+                out_bin.diseases, out_bin.locations)['CC33'], correct)
+        print('Passed test_binary_labels()')
+    
+    def test_packed_labels(self):
+        values = np.zeros((2,2,11),dtype='uint8')
+        values[0,0,1] = 1
+        values[1,1,0] = 1
+        values[1,1,10] = 1
+        locations = ['loc'+str(x) for x in range(10)]+['other_location']
+        out_bin = label_store.BinaryLabels(['AA11','BB22'], ['nodule','other_disease'], locations, values)
+        results_dir = 'testing_delthis'
+        if not os.path.exists(results_dir):
+            os.mkdir(results_dir)
+        out_bin.save_packed(os.path.join(results_dir,'imgtrain'))
+        packed = label_store.PackedLabels(os.path.join(results_dir,'imgtrain'))
+        assert packed.packed.shape == (2,2,2)
+        assert packed.keys() == ['AA11','BB22']
+        assert eqc.dfs_equal(packed['BB22'], out_bin['BB22'])
+        assert eqc.arrays_equal(packed.matrix('AA11'), values[0], tol=0)
+        assert eqc.arrays_equal(packed.to_binary_labels().array.reshape(2,-1), values.reshape(2,-1), tol=0)
+        del packed
+        
+        #Numeric filenames keep their type
+        out_bin = label_store.BinaryLabels([1012,7], ['nodule','other_disease'], locations, values)
+        out_bin.save_packed(os.path.join(results_dir,'numeric'))
+        packed = label_store.PackedLabels(os.path.join(results_dir,'numeric'))
+        assert packed.keys() == [1012,7]
+        assert 7 in packed and '7' not in packed
+        assert eqc.arrays_equal(packed.matrix(7), values[1], tol=0)
+        assert packed.to_binary_labels().keys() == [1012,7]
+        del packed
+        
+        #Results directories with only the old _BinaryLabels.pkl can be loaded
+        pickle.dump(out_bin.to_dict(), open(os.path.join(results_dir,'old_BinaryLabels.pkl'),'wb'))
+        loaded = label_store.load_binary_labels(os.path.join(results_dir,'old'))
+        assert loaded.keys() == [1012,7] and loaded.locations == locations
+        assert eqc.arrays_equal(loaded.array.reshape(2,-1), values.reshape(2,-1), tol=0)
+        shutil.rmtree(results_dir)
+        print('Passed test_packed_labels()')
+
+if __name__=='__main__':
+    unittest.main()
@@ -59,6 +59,28 @@ class TestLoad(unittest.TestCase):
             columns=['Label','Sentence','Filename','Section'])
         assert output.equals(correct)
         print('Passed test_load_expand_by_indication()')
+    
+    def test_split_indication_sentence(self):
+        #cleanup words cut the rest of the subsentence, and plagues are removed
+        output = load.split_indication_sentence('indication shortness of breath rule out pneumonia history copd follow up none')
+        assert output == ['shortness of breath ','copd']
+        output = load.split_indication_sentence('indication chest ct history of preop evaluation for lung nodule compare 2019 ct chest f u nodule')
+        assert output == ['','nodule']
+        print('Passed test_split_indication_sentence()')
+    
+    def test_remove_and_report_overlap(self):
+        train = pd.DataFrame([['a','1'],['b','1'],['a','2']], columns=['Sentence','Filename'])
+        test = pd.DataFrame([['c','3'],['a','3'],['d','4'],['a','4']], columns=['Sentence','Filename'],
+                            index=[10,11,12,13])
+        predict = pd.DataFrame([['d','5'],['e','5']], columns=['Sentence','Filename'])
+        output = load.remove_overlap(test, train)
+        assert output.index.values.tolist() == [10,12]
+        assert output['Sentence'].values.tolist() == ['c','d']
+        stats = load.report_overlap({'train':train,'test':test,'predict':predict})
+        assert stats[('train','test')] == {'shared_unique':1,'second_rows_in_first':2,'second_rows':4}
+        assert stats[('train','predict')] == {'shared_unique':0,'second_rows_in_first':0,'second_rows':2}
+        assert stats[('test','predict')] == {'shared_unique':1,'second_rows_in_first':1,'second_rows':2}
+        print('Passed test_remove_and_report_overlap()')
 
 if __name__=='__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,52 @@
+#test_sentence_cascade.py
+#Copyright (c) 2020 Rachel Lea Ballantyne Draelos
+
+#MIT License
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE
+
+import unittest
+
+from src import load, evaluation, sentence_cascade
+
+class TestSentenceCascade(unittest.TestCase):
+    def test_cascade(self):
+        train, test, predict = load.load_merged_with_style('openi_cxr','trainall_testall')
+        m = sentence_cascade.CascadeSentences(train, test, predict, '', 'pos',
+                    'cxr_amb_pos_rules', classifier_backend='hashing')
+        m.run_all()
+        out = m.test_data
+        assert out.shape[0] == test.shape[0]
+        #Sentences deleted by the rules (and not uncertain) skip the classifier
+        assert m.classified_counts['test'] < 0.6*test.shape[0]
+        #Sick sentences always have text left for the term search
+        assert (out[out['PredLabel']==1]['Sentence'] != '').all()
+        acc, auc, ap = evaluation.calculate_eval_metrics(out['PredLabel'].values.tolist(),
+                    out['PredProb'].values.tolist(), out['BinLabel'].values.tolist())
+        assert acc > 0.95
+        #The column runtime of the rules gives the same output
+        column = sentence_cascade.CascadeSentences(train, test, predict, '', 'pos',
+                    'cxr_amb_pos_rules', classifier_backend='hashing', rules_runtime='column')
+        column.run_all()
+        for c in ['Sentence','PredLabel','PredProb']:
+            assert column.test_data[c].values.tolist() == out[c].values.tolist(), c
+        print('Passed test_cascade()')
+
+if __name__=='__main__':
+    unittest.main()
@@ -22,13 +22,14 @@
 #SOFTWARE
 
 import os
+import pickle
 import shutil
 import unittest
 import pandas as pd
 import numpy as np
 
-from src import term_search
-from src.vocab import vocabulary_ct, vocabulary_locations
+from src import term_search, label_store
+from src.vocab import vocabulary_ct, vocabulary_cxr, vocabulary_locations
 
 from tests import equality_checks as eqc
 
@@ -500,6 +501,110 @@ class TestTermSearch(unittest.TestCase):
             answer = tup[2]
             assert answer==term_search.RadLabel.label_for_keyterm_and_sentence(keyterm, sentence, termdict)
         print('Passed test_label_for_keyterm_and_sentence()')
+
+    def test_term_matcher(self):
+        #TermMatcher must agree with label_for_keyterm_and_sentence() for every
+        #keyterm of both vocabularies
+        global sarle_x
+        sentences = [' '+x[2]+' ' for x in sarle_x]+['','pericardial effusion','left pleural fluid',
+                     'fluid in the pleura','pleural effusion in the liver']
+        for vocabmodule in [vocabulary_ct, vocabulary_cxr]:
+            m = term_search.RadLabel(data=pd.DataFrame(), setname='train',
+                                     dataset_descriptor='openi_cxr' if vocabmodule==vocabulary_cxr else 'duke_ct_2019_09_25',
+                                     results_dir='', run_locdis_checks=True, save_output_files=False)
+            m.initialize_vocabulary_dicts()
+            termdicts = {'location':m.mega_loc_dict, 'disease':m.mega_disease_dict}
+            for sentence in sentences:
+                hits = m.term_matcher.find_hits(sentence)
+                for name, termdict in termdicts.items():
+                    for keyterm in termdict.keys():
+                        assert m.term_matcher.label(name, keyterm, hits)==term_search.RadLabel.label_for_keyterm_and_sentence(keyterm, sentence, termdict), keyterm+': '+sentence
+        print('Passed test_term_matcher()')
+
+    def test_term_search_workers(self):
+        #Parallel term search must give the same output as the serial one
+        global sarle_x
+        fake_merged = pd.DataFrame([[1,x[2],x[0],x[1],1,0.9,1] for x in sarle_x],
+             columns=['Count','Sentence','Filename','Section','PredLabel','PredProb','BinLabel'])
+        outputs = []
+        for workers in [1,2]:
+            m = term_search.RadLabel(data=fake_merged.copy(), setname='predict',
+                                     dataset_descriptor='duke_ct_2019_09_25',
+                                     results_dir='', run_locdis_checks=True,
+                                     save_output_files=False, workers=workers)
+            outputs.append(m)
+        serial, parallel = outputs
+        assert serial.out_bin.filenames == parallel.out_bin.filenames
+        assert (serial.out_bin.array == parallel.out_bin.array).all()
+        assert serial.out_bin.array.sum() > 0
+        assert eqc.dfs_equal(serial.disease_out, parallel.disease_out)
+        assert ((serial.wrong_lung_values, serial.wrong_heart_values, serial.wrong_vessel_values)
+                ==(parallel.wrong_lung_values, parallel.wrong_heart_values, parallel.wrong_vessel_values))
+        print('Passed test_term_search_workers()')
+    
+    def test_term_search_incremental(self):
+        #Incremental term search must give the same output as labeling
+        #everything from scratch, while only labeling new or changed reports
+        global sarle_x
+        results_dir = 'testing_delthis'
+        if not os.path.exists(results_dir):
+            os.mkdir(results_dir)
+        old_data = pd.DataFrame([[1,x[2],x[0],x[1],1,0.9,1] for x in sarle_x],
+             columns=['Count','Sentence','Filename','Section','PredLabel','PredProb','BinLabel'])
+        term_search.RadLabel(data=old_data.copy(), setname='predict',
+                             dataset_descriptor='custom_ct', results_dir=results_dir,
+                             run_locdis_checks=True)
+        #The pickled labels are in the old output format, a plain dictionary
+        legacy = pickle.load(open(os.path.join(results_dir,'imgtrain_notepredict_BinaryLabels.pkl'),'rb'))
+        assert type(legacy) == dict and isinstance(legacy['000022_CTAAES'], pd.DataFrame)
+        #Change one report and add a new report
+        new_data = old_data.copy()
+        new_data.loc[new_data['Filename']=='000022_CTAAES','Sentence'] = 'the heart is enlarged'
+        new_data = pd.concat([new_data, pd.DataFrame([[1,'left pneumothorax','AAFF','Findings',1,0.9,1]],
+                                                     columns=new_data.columns)], ignore_index=True)
+        scratch = term_search.RadLabel(data=new_data.copy(), setname='predict',
+                             dataset_descriptor='custom_ct', results_dir=results_dir,
+                             run_locdis_checks=True, save_output_files=False)
+        incremental = term_search.RadLabel(data=new_data.copy(), setname='predict',
+                             dataset_descriptor='custom_ct', results_dir=results_dir,
+                             run_locdis_checks=True, save_output_files=False,
+                             previous_term_search_dir=results_dir)
+        assert incremental.out_bin.filenames == scratch.out_bin.filenames
+        assert (incremental.out_bin.array == scratch.out_bin.array).all()
+        assert eqc.dfs_equal(incremental.disease_out, scratch.disease_out)
+        assert eqc.dfs_equal(incremental.missing, scratch.missing)
+        #only the changed report and the new report were labeled again
+        previous_bin = incremental.load_previous_labels()
+        assert sorted(previous_bin.keys()) == sorted(set(old_data['Filename'].values.tolist())-set(['000022_CTAAES']))
+        shutil.rmtree(results_dir)
+        print('Passed test_term_search_incremental()')
+    
+    def test_term_search_chunks(self):
+        #Streaming term search over chunks of a CSV must give the same output
+        #as running RadLabel on the whole set
+        global sarle_x
+        results_dir = 'testing_delthis'
+        if not os.path.exists(results_dir):
+            os.mkdir(results_dir)
+        fake_merged = pd.DataFrame([[1,x[2],x[0],x[1],1,0.9,1] for x in sarle_x],
+             columns=['Count','Sentence','Filename','Section','PredLabel','PredProb','BinLabel'])
+        fake_merged.to_csv(os.path.join(results_dir,'fake_merged.csv'), index=False)
+        whole = term_search.RadLabel(data=fake_merged.copy(), setname='predict',
+                             dataset_descriptor='custom_ct', results_dir=results_dir,
+                             run_locdis_checks=True, save_output_files=False)
+        chunks = list(term_search.read_csv_in_report_chunks(os.path.join(results_dir,'fake_merged.csv'), chunksize=7))
+        assert len(chunks) > 1
+        assert sum([chunk.shape[0] for chunk in chunks]) == fake_merged.shape[0]
+        n_reports = term_search.term_search_chunks(chunks, 'predict', 'custom_ct', results_dir, True)
+        assert n_reports == len(whole.out_bin)
+        packed = label_store.PackedLabels(os.path.join(results_dir,'imgtrain_notepredict'))
+        streamed = packed.to_binary_labels().select(whole.out_bin.filenames)
+        assert (streamed.array == whole.out_bin.array).all()
+        disease_out = pd.read_csv(os.path.join(results_dir,'imgtrain_notepredict_DiseaseBinaryLabels.csv'), header=0, index_col=0)
+        assert eqc.dfs_equal(disease_out.loc[whole.disease_out.index,:], whole.disease_out)
+        del packed
+        shutil.rmtree(results_dir)
+        print('Passed test_term_search_chunks()')
     
     def test_label_for_right_and_left_from_diseases(self):
         lung_path_dict = vocabulary_ct.LUNG_PATHOLOGY
@@ -531,6 +636,13 @@ class TestTermSearch(unittest.TestCase):
                                  results_dir='', 
                                  run_locdis_checks=True,
                                  save_output_files=True) #in this case we do want to save the output files so we can check them
+        #Clean up the output files even if a check fails
+        for path in ['imgtrain_notetrain_BinaryLabels.pkl','imgtrain_notetrain_PackedLabels.npy',
+                     'imgtrain_notetrain_PackedLabels.json','imgtrain_notetrain_ReportHashes.pkl',
+                     'imgtrain_notetrain_DiseaseBinaryLabels.csv','imgtrain_notetrain_Missingness.csv',
+                     'imgtrain_notetrain_merged.csv','train_other_location_sentences.txt',
+                     'train_other_disease_sentences.txt']:
+            self.addCleanup(os.remove, path)
         
         #Check correctness of everything
         used_files = ['000013_CTAAEJ', '000022_CTAAES','000038_CTAAFI','008266_CTAKMI',
@@ -577,14 +689,6 @@ class TestTermSearch(unittest.TestCase):
                         [0,1,1]],columns = ['left_lobes_all','right_lobes_all','lungs_right_left'],
                                index = used_files)
         assert eqc.dfs_equal(output_miss, correct_miss)
-    
-        #Clean up
-        os.remove('imgtrain_notetrain_BinaryLabels.pkl')
-        os.remove('imgtrain_notetrain_DiseaseBinaryLabels.csv')
-        os.remove('imgtrain_notetrain_Missingness.csv')
-        os.remove('imgtrain_notetrain_Merged.csv')
-        os.remove('train_other_location_sentences.txt')
-        os.remove('train_other_disease_sentences.txt')
         print('Passed test_obtain_sarle_labels_and_missingness()')
 
 ###########
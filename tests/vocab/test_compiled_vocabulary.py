@@ -0,0 +1,73 @@
+#test_compiled_vocabulary.py
+#Copyright (c) 2020 Rachel Lea Ballantyne Draelos
+
+#MIT License
+
+#Permission is hereby granted, free of charge, to any person obtaining a copy
+#of this software and associated documentation files (the "Software"), to deal
+#in the Software without restriction, including without limitation the rights
+#to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the Software is
+#furnished to do so, subject to the following conditions:
+
+#The above copyright notice and this permission notice shall be included in all
+#copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#SOFTWARE
+
+import os
+import shutil
+import unittest
+import numpy as np
+
+from src.vocab import vocabulary_ct, vocabulary_cxr, compiled_vocabulary
+
+class TestCompiledVocabulary(unittest.TestCase):
+    def test_compiled_vocabulary(self):
+        vocabulary = compiled_vocabulary.CompiledVocabulary(vocabulary_ct)
+        assert vocabulary.diseases[-1] == 'other_disease'
+        assert vocabulary.locations[-1] == 'other_location'
+        assert vocabulary.disease_index['pneumonia'] == vocabulary.diseases.index('pneumonia')
+        #Forbidden masks
+        lung_mask = vocabulary.forbidden_masks['lung']
+        assert lung_mask[vocabulary.disease_index['pneumonia'],vocabulary.location_index['heart']]
+        assert not lung_mask[vocabulary.disease_index['pneumonia'],vocabulary.location_index['right_lung']]
+        for disease in vocabulary_ct.return_forbidden('lung'):
+            assert lung_mask[vocabulary.disease_index[disease],vocabulary.location_index['lung']]
+        for system in ['lung','heart','great_vessel']:
+            assert not vocabulary.forbidden_masks[system][:,-1].any() #other_location
+        #The vocabularies are different so the fingerprints are different
+        assert vocabulary.fingerprint != compiled_vocabulary.fingerprint_vocabulary(vocabulary_cxr)
+        print('Passed test_compiled_vocabulary()')
+    
+    def test_load_compiled_vocabulary(self):
+        cache_dir = 'testing_delthis'
+        compiled_vocabulary.LOADED.clear()
+        vocabulary = compiled_vocabulary.load_compiled_vocabulary(vocabulary_cxr, cache_dir)
+        cache_files = os.listdir(cache_dir)
+        assert cache_files == ['CompiledVocabulary_'+compiled_vocabulary.return_cache_key(vocabulary_cxr)+'.pkl']
+        #the cache key covers the code as well as the vocabulary
+        assert compiled_vocabulary.return_cache_key(vocabulary_cxr) != vocabulary.fingerprint
+        #loaded again from the same process
+        assert compiled_vocabulary.load_compiled_vocabulary(vocabulary_cxr, cache_dir) is vocabulary
+        #loaded again from the cache file
+        compiled_vocabulary.LOADED.clear()
+        reloaded = compiled_vocabulary.load_compiled_vocabulary(vocabulary_cxr, cache_dir)
+        assert reloaded is not vocabulary
+        assert reloaded.fingerprint == vocabulary.fingerprint
+        assert reloaded.term_matcher.terms == vocabulary.term_matcher.terms
+        for system in ['lung','heart','great_vessel']:
+            assert np.array_equal(reloaded.forbidden_masks[system], vocabulary.forbidden_masks[system])
+        hits = reloaded.term_matcher.find_hits('small left pleural effusion')
+        assert reloaded.term_matcher.label('disease','pleural_effusion',hits) == 1
+        shutil.rmtree(cache_dir)
+        print('Passed test_load_compiled_vocabulary()')
+
+if __name__=='__main__':
+    unittest.main()